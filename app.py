@@ -1,17 +1,28 @@
 import streamlit as st
-import requests
 import os
+import asyncio
+import threading
+import time
+import concurrent.futures
 import smtplib
 from email.message import EmailMessage
 from dotenv import load_dotenv
 
-from openai import OpenAI
-from io import BytesIO
+from openai import APITimeoutError
+from image_cache import FAILED_DOWNLOAD_TTL_SECONDS, NO_RESULTS_TTL_SECONDS, get_image_cache
+from clients import CircuitOpenError, tier_client
+from unsplash import BatchResolver
+from canonical import canonical_city, strip_time_of_day
+from wire_schema import expand_itinerary_text, missing_text_days, parse_compact_text
+from llm_fragments import fragment_tokens, get_fragment_cache
+from llm_hedge import get_hedge_policy, hedged_call
+from model_router import get_model_router
+from images import DEFAULT_DPI_PROFILE, DPI_PROFILES, IMAGE_PHASE_BUDGET_SECONDS, EmbeddedImage, download_to_cache, image_placeholder, prepare_embeddable, render_size, sized_image_url
 
 # --- REPORTLAB IMPORTS (For Professional PDF) ---
 from reportlab.lib.pagesizes import A4
 from reportlab.lib import colors
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Image as ReportLabImage, PageBreak, Table, TableStyle, KeepTogether
+from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, PageBreak, Table, TableStyle, KeepTogether
 from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 from reportlab.lib.units import inch
 
@@ -36,7 +47,9 @@ UNSPLASH_KEY = get_env("UNSPLASH_ACCESS_KEY") or "YOUR_UNSPLASH_KEY_HERE"
 EMAIL_ADDRESS = get_env("EMAIL_ADDRESS") or "YOUR_EMAIL_HERE"
 EMAIL_PASSWORD = get_env("EMAIL_PASSWORD") or "YOUR_APP_PASSWORD_HERE"
 
-client = OpenAI(api_key=OPENAI_KEY)
+# This script runs on every rerun; the connection pool behind the client is built once per process.
+# No retries: a timed-out tier falls back to the next one instead
+client = tier_client(OPENAI_KEY)
 
 # ---------------- STREAMLIT UI ---------------- #
 st.set_page_config(page_title="Luxe AI Travel", page_icon="✈️", layout="centered")
@@ -62,87 +75,261 @@ with st.form("travel_form"):
         budget = st.selectbox("Budget", ["Standard", "High-End", "Luxury"])
         travelers = st.number_input("Travelers", 1, 10, 2)
         trip_type = st.selectbox("Vibe", ["Relaxing", "Adventure", "Cultural", "Foodie", "Family"])
+        image_profile = st.selectbox("Image Quality", list(DPI_PROFILES), index=list(DPI_PROFILES).index(DEFAULT_DPI_PROFILE))
     
     email = st.text_input("Email Address for Delivery")
     submit_btn = st.form_submit_button("✨ Generate Full Itinerary")
 
 # ---------------- HELPER FUNCTIONS ---------------- #
 
-def fetch_image(query):
-    """Downloads a high-quality image from Unsplash based on the specific location."""
+IMAGE_FETCH_CONCURRENCY = 6   # Max image lookups in flight at once
+IMAGE_REQUEST_TIMEOUT = 10    # Seconds, applied to each HTTP request
+IMAGE_COL_WIDTH = 2.8 * inch  # Width of the photo column in each stop table
+
+def resolve_image_urls(stops, timeout=IMAGE_REQUEST_TIMEOUT):
+    """Finds an Unsplash photo for each stop, batching searches per destination.
+
+    stops maps search query -> place name. Returns (query -> URL or None, API calls made).
+    """
+    cache = get_image_cache()
+    # Searches use what the user typed; the cache is keyed on the canonical city
+    keys = {query: stop_cache_query(name) for query, name in stops.items()}
+    urls = {query: cache.lookup_url(keys[query]) for query in stops}
+    # Skip queries that recently came back empty instead of spending quota on them
+    misses = {query: stops[query] for query, url in urls.items() if not url and not cache.is_failed("query", keys[query])}
+    
+    resolver = BatchResolver(UNSPLASH_KEY, destination, timeout=timeout)
     try:
-        url = "https://api.unsplash.com/search/photos"
-        headers = {"Authorization": f"Client-ID {UNSPLASH_KEY}"}
-        # Landscape orientation fits our table layout best
-        params = {"query": query, "per_page": 1, "orientation": "landscape"}
-        
-        res = requests.get(url, headers=headers, params=params)
-        data = res.json()
-        
-        if data.get("results"):
-            img_url = data["results"][0]["urls"]["small"]
-            img_response = requests.get(img_url)
-            return BytesIO(img_response.content)
+        resolved = resolver.resolve(misses)
+    except Exception as e:
+        print(f"Image Error for {destination}: {e}")
+        resolved = {}
+    
+    for query in misses:
+        urls[query] = resolved.get(query)
+        if urls[query]:
+            cache.store_url(keys[query], urls[query])
+        elif query in resolver.no_results:
+            cache.mark_failed("query", keys[query], NO_RESULTS_TTL_SECONDS)
+    return urls, resolver.api_calls
+
+def fetch_image(img_url, timeout=IMAGE_REQUEST_TIMEOUT, profile=DEFAULT_DPI_PROFILE):
+    """Downloads a high-quality image from Unsplash for a resolved photo URL.
+
+    Returns a PreparedImage: a content-addressed JPEG (so the same photo used
+    by several stops is embedded only once) plus its pixel size, so the table
+    can lay it out without opening the file again.
+    """
+    # Ask the CDN for the column width at the chosen DPI, keeping the photo's aspect
+    img_url = sized_image_url(img_url, IMAGE_COL_WIDTH, profile=profile)
+    cache = get_image_cache()
+    try:
+        if cache.is_failed("url", img_url):
+            return None
+        # Streamed to disk under a byte cap, then decoded from the file
+        path = download_to_cache(img_url, timeout=timeout)
+        if path is None:
+            cache.mark_failed("url", img_url, FAILED_DOWNLOAD_TTL_SECONDS)
+            return None
+        width_px, _ = render_size(IMAGE_COL_WIDTH, profile=profile)
+        return prepare_embeddable(path, (width_px, width_px * 2), DPI_PROFILES[profile]["quality"])
+    except CircuitOpenError:
+        pass  # Host is known to be down; the stop gets a placeholder without waiting
     except Exception as e:
-        print(f"Image Error for {query}: {e}")
+        cache.mark_failed("url", img_url, FAILED_DOWNLOAD_TTL_SECONDS)
+        print(f"Image Error for {img_url}: {e}")
     return None
 
+@st.cache_resource
+def get_fetch_loop():
+    """One background asyncio loop per process, shared by every session and rerun."""
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, daemon=True, name="image-fetch-loop").start()
+    return loop
+
+class ImageFetcher:
+    """Fetches stop images on the background loop with bounded concurrency.
+
+    start() schedules a batch of stops and returns immediately; result() blocks
+    only until that particular image is ready (or has failed / timed out).
+    Nothing is waited on past the overall budget: late images come back as
+    None and are cancelled. api_calls counts the Unsplash searches made for
+    this PDF, late the stops that missed the deadline.
+    """
+
+    def __init__(self, concurrency=IMAGE_FETCH_CONCURRENCY, timeout=IMAGE_REQUEST_TIMEOUT,
+                 profile=DEFAULT_DPI_PROFILE, budget=IMAGE_PHASE_BUDGET_SECONDS):
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.profile = profile
+        self.budget = budget
+        self.deadline = time.monotonic() + budget
+        self.api_calls = 0
+        self.late = 0
+        self._loop = get_fetch_loop()
+        self._semaphore = None
+        self._futures = {}
+
+    async def _resolve(self, stops):
+        urls, api_calls = await self._loop.run_in_executor(None, resolve_image_urls, stops, self.timeout)
+        self.api_calls += api_calls
+        return urls
+
+    async def _fetch(self, query, resolving):
+        img_url = (await asyncio.wrap_future(resolving)).get(query)
+        if not img_url:
+            return None
+        # Created lazily so it binds to the background loop, not the script thread
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        async with self._semaphore:
+            try:
+                # Each request honours self.timeout; this caps retries on top of it
+                return await asyncio.wait_for(
+                    self._loop.run_in_executor(None, fetch_image, img_url, self.timeout, self.profile),
+                    timeout=2 * self.timeout,
+                )
+            except asyncio.TimeoutError:
+                print(f"Image Timeout for {query}")
+                return None
+
+    def start(self, stops):
+        """Schedules every stop not already in flight; stops maps search query -> place name."""
+        new = {query: name for query, name in stops.items() if query not in self._futures}
+        if not new:
+            return
+        # One shared resolution step lets the searches be batched per destination
+        resolving = asyncio.run_coroutine_threadsafe(self._resolve(new), self._loop)
+        for query in new:
+            self._futures[query] = asyncio.run_coroutine_threadsafe(self._fetch(query, resolving), self._loop)
+
+    def result(self, query):
+        self.start({query: query})
+        future = self._futures[query]
+        try:
+            return future.result(timeout=max(0, self.deadline - time.monotonic()))
+        except (concurrent.futures.TimeoutError, concurrent.futures.CancelledError):
+            future.cancel()
+            self.late += 1
+            return None
+        except Exception as e:
+            # One failed stop gets a placeholder rather than failing the whole PDF
+            print(f"Image Error for {query}: {e}")
+            return None
+
+    def cancel_pending(self):
+        """Drops whatever is still in flight; running downloads still warm the cache."""
+        for future in self._futures.values():
+            future.cancel()
+
+def stop_search_query(place_name):
+    """Unsplash query for a stop: the destination as typed, and the stop without its time of day."""
+    return f"{destination} {strip_time_of_day(place_name)}"
+
+def stop_cache_query(place_name):
+    """Image cache key for a stop, so "Louvre - Morning" in "Paris, France" shares an entry with "Louvre" in "paris"."""
+    return f"{canonical_city(destination)} {strip_time_of_day(place_name)}"
+
 # ---------------- OPENAI LOGIC ---------------- #
 
+# Sections that depend only on the route or the destination; cached on their
+# own and left out of the prompt when cached (see llm_fragments.py)
+GETTING_THERE_PROMPT = "G: Best Flights/Trains/Road route from {source}"
+TRAVEL_TIPS_PROMPT = """TIPS:
+    - Bullet points on safety, weather, packing"""
+
 def generate_itinerary_text():
+    fragments = get_fragment_cache()
+    getting_there = fragments.get("getting_there", GETTING_THERE_PROMPT, source, destination)
+    tips = fragments.get("travel_tips", TRAVEL_TIPS_PROMPT, destination=destination)
+    
+    # Compact line format (see wire_schema.py): section labels, title, day
+    # numbers, food labels and map links are filled in by expand_itinerary_text
     prompt = f"""
     Act as an elite travel planner. Create a highly detailed {days}-day itinerary for {destination} departing from {source}.
     
     Vibe: {trip_type} | Budget: {budget} | Travelers: {travelers}
 
-    **CRITICAL STRUCTURE INSTRUCTIONS:**
-    
-    1. **GENERAL INFO:**
-    TITLE: Journey to {destination}
-    OVERVIEW: (Brief summary of the experience)
-    GETTING_THERE: (Best Flights/Trains/Road route from {source})
-
-    2. **TIMELINE (Summary Table):**
-    TIMELINE_START
-    Day 1: [Brief Summary]
-    Day 2: [Brief Summary]
-    (etc...)
-    TIMELINE_END
-
-    3. **DETAILED STOPS (Visual Guide):**
-    ITINERARY_START
-    
-    Day 1: [Day Title]
-    
-    STOP: [Exact Name of Place/Activity - Morning]
-    BEST TIME: [e.g. 09:00 AM]
-    LOGISTICS: [How to get here from city center/last spot]
-    DETAILS: [Description with Google Maps Link like <link href="http://maps.google.com/?q={destination}+PLACE_NAME" color="blue">Open Map</link>]
-    FOOD: 
-    - 🥗 Veg: [Name] (Cuisine)
-    - 🍗 Non-Veg: [Name] (Cuisine)
-    
-    STOP: [Exact Name of Place/Activity - Afternoon]
-    BEST TIME: [e.g. 2:00 PM]
-    LOGISTICS: [How to get here]
-    DETAILS: [Description with Map Link]
-    FOOD: 
-    - 🥗 Veg: [Name] (Cuisine)
-    - 🍗 Non-Veg: [Name] (Cuisine)
-    
-    (Repeat STOP structure for all days)
-    ITINERARY_END
-    
-    TRAVEL_TIPS:
-    (Bullet points on safety, weather, packing)
+    **OUTPUT FORMAT (one tagged line each, no markdown, no other text):**
+    O: Brief summary of the experience
+    {"" if getting_there else GETTING_THERE_PROMPT.format(source=source)}
+    T: One-line summary of Day 1
+    T: One-line summary of Day 2
+    (one T line per day)
+    D: Day 1 title
+    S: Exact Name of Place/Activity | M
+    B: Best time, e.g. 09:00 AM
+    L: How to get here from city center/last spot
+    X: Description
+    V: Vegetarian restaurant name (Cuisine)
+    N: Non-vegetarian restaurant name (Cuisine)
+    S: Exact Name of Place/Activity | A
+    (B, L, X, V, N lines again)
+    (2-3 S blocks per day, M/A/E = Morning/Afternoon/Evening; repeat D and its S blocks for all {days} days)
+    {"" if tips else TRAVEL_TIPS_PROMPT}
     """
 
     try:
-        response = client.chat.completions.create(
-            model="gpt-4o", # Use gpt-3.5-turbo if on a budget
-            messages=[{"role": "user", "content": prompt}]
-        )
-        return response.choices[0].message.content
+        # Model tier from trip size, budget and live latency; the next tier
+        # takes over if one times out or leaves days out
+        router = get_model_router()
+        tiers = router.route(days, budget)
+        best = None  # Most complete partial plan so far: (missing days, response, content, tier, elapsed)
+        for attempt, tier in enumerate(tiers):
+            started = time.monotonic()
+            try:
+                # A slow request is hedged with an identical one (see llm_hedge)
+                response = hedged_call(f"{tier.model}:text", lambda: client.chat.completions.create(
+                    model=tier.model,
+                    messages=[{"role": "user", "content": prompt}],
+                    timeout=tier.timeout
+                ))
+                content = response.choices[0].message.content or ""
+                missing = missing_text_days(content, days)
+                if missing:
+                    if len(missing) < days and (best is None or len(missing) < len(best[0])):
+                        best = (missing, response, content, tier, time.monotonic() - started)
+                    raise ValueError(f"day(s) {', '.join(map(str, missing))} missing")
+            except (APITimeoutError, ValueError) as e:
+                outcome = "timeout" if isinstance(e, APITimeoutError) else "invalid"
+                router.record(tier, time.monotonic() - started, outcome, [source, destination, days, budget])
+                if attempt == len(tiers) - 1:
+                    if best is None:
+                        raise
+                    # Every tier left days out; a partial plan still beats no PDF
+                    missing, response, content, tier, elapsed = best
+                    st.warning(f"⚠️ Day(s) {', '.join(map(str, missing))} could not be planned and are left out")
+                    break
+                st.caption(f"↪️ {tier.model} {'timed out' if outcome == 'timeout' else f'returned an incomplete plan ({e})'}; "
+                           f"retrying with {tiers[attempt + 1].model}")
+                continue
+            elapsed = time.monotonic() - started
+            router.record(tier, elapsed, "ok", [source, destination, days, budget])
+            break
+        if response.usage:
+            st.caption(f"🧾 {response.usage.completion_tokens} completion tokens in {elapsed:.1f}s "
+                       f"on the {tier.name} tier ({tier.model})")
+        hedges = get_hedge_policy().stats()
+        if hedges['hedged']:
+            st.caption(f"🏁 Hedged {hedges['hedged']}/{hedges['requests']} requests, "
+                       f"hedge won {hedges['hedge_wins']}, {hedges['capped']} held back by the rate cap")
+        
+        parsed = parse_compact_text(content)
+        completion_tokens = response.usage.completion_tokens if response.usage else None
+        sections, saved = {}, 0
+        for name, section, template, cached in (("getting_there", "getting_there", GETTING_THERE_PROMPT, getting_there),
+                                                ("travel_tips", "tips", TRAVEL_TIPS_PROMPT, tips)):
+            if cached:
+                sections[section], tokens = cached
+                saved += tokens
+            else:
+                lines = parsed[section]
+                fragments.put(name, template, lines, fragment_tokens("\n".join(lines), content, completion_tokens),
+                              source=source, destination=destination)
+        if saved:
+            st.caption(f"🧩 Reused cached {' and '.join(name.replace('_', ' ') for name in sections)} "
+                       f"for {destination}, saving ~{saved} completion tokens")
+        return expand_itinerary_text(content, destination, sections)
     except Exception as e:
         st.error(f"OpenAI Error: {e}")
         return None
@@ -167,7 +354,7 @@ def add_page_design(canvas, doc):
     canvas.drawRightString(w-40, 30, "Luxe AI Travel Agent")
     canvas.restoreState()
 
-def create_stop_table(story, lines, style_body, style_bold):
+def create_stop_table(story, lines, style_body, style_bold, fetcher):
     """Creates the Side-by-Side [Text | Image] layout for a specific stop."""
     place_name = ""
     details_text = []
@@ -188,24 +375,20 @@ def create_stop_table(story, lines, style_body, style_bold):
             # Contains description or food items
             details_text.append(Paragraph(line, style_body))
             
-    # Fetch Image specific to THIS place
+    # Image for THIS place was already started by generate_pdf; wait for it here
     st.write(f"📸 Finding photo for: {place_name}...") # UI Feedback
-    search_query = f"{destination} {place_name}"
-    img_bytes = fetch_image(search_query)
+    prepared = fetcher.result(stop_search_query(place_name))
     
     img_col = []
-    if img_bytes:
-        img = ReportLabImage(img_bytes)
-        # Resize image to fit the column width (2.8 inches)
-        aspect = img.imageHeight / img.imageWidth
-        target_w = 2.8 * inch
-        img.drawWidth = target_w
-        img.drawHeight = target_w * aspect
-        img_col = [img]
+    if prepared:
+        # Sized to the column width (2.8 inches) from the pre-measured aspect ratio
+        img_col = [EmbeddedImage(prepared, IMAGE_COL_WIDTH)]
+    else:
+        img_col = [image_placeholder(IMAGE_COL_WIDTH, IMAGE_COL_WIDTH * 0.75)]
     
     # Table: Text Left (4 inch) | Image Right (2.8 inch)
     data = [[details_text, img_col]]
-    t = Table(data, colWidths=[4*inch, 2.8*inch])
+    t = Table(data, colWidths=[4*inch, IMAGE_COL_WIDTH])
     t.setStyle(TableStyle([
         ('VALIGN', (0,0), (-1,-1), 'TOP'),
         ('RIGHTPADDING', (0,0), (-1,-1), 10),
@@ -230,6 +413,16 @@ def generate_pdf(text_content):
     story = []
     lines = text_content.split('\n')
     
+    # Kick off every stop image up front so downloads overlap with parsing
+    fetcher = ImageFetcher(profile=image_profile)
+    stops = {}
+    for line in lines:
+        line = line.strip()
+        if line.startswith("STOP:"):
+            place_name = line.replace("STOP:", "").strip()
+            stops[stop_search_query(place_name)] = place_name
+    fetcher.start(stops)
+    
     current_day = ""
     stop_buffer = []
     timeline_data = [["Day", "Summary"]] # Header for Timeline Table
@@ -270,7 +463,7 @@ def generate_pdf(text_content):
             section_state = "NORMAL"
             # Flush any remaining buffer
             if stop_buffer:
-                create_stop_table(story, stop_buffer, style_body, style_bold)
+                create_stop_table(story, stop_buffer, style_body, style_bold, fetcher)
             continue
             
         # --- CONTENT PARSING BASED ON STATE ---
@@ -290,7 +483,7 @@ def generate_pdf(text_content):
             elif line.startswith("STOP:"):
                 # If we have a previous stop buffered, print it first
                 if stop_buffer:
-                    create_stop_table(story, stop_buffer, style_body, style_bold)
+                    create_stop_table(story, stop_buffer, style_body, style_bold, fetcher)
                     stop_buffer = [] 
                 stop_buffer.append(line) 
             else:
@@ -311,7 +504,11 @@ def generate_pdf(text_content):
             else:
                 story.append(Paragraph(line, style_body))
 
+    fetcher.cancel_pending()
     doc.build(story, onFirstPage=add_page_design, onLaterPages=add_page_design)
+    st.caption(f"🔎 Unsplash API calls for this PDF: {fetcher.api_calls}")
+    if fetcher.late:
+        st.caption(f"⏱️ {fetcher.late} image(s) missed the {fetcher.budget:g}s budget and were replaced with placeholders")
     return pdf_filename
 
 # ---------------- EMAIL LOGIC ---------------- #
@@ -354,6 +551,10 @@ if submit_btn:
             if raw_text:
                 # 2. Create PDF (The Artist)
                 pdf_file = generate_pdf(raw_text)
+                cache_stats = get_image_cache().stats()
+                st.caption(f"🗂️ Image cache: {cache_stats['url_hits']} lookup hits "
+                           f"({cache_stats['url_hits_canonical_only']} via canonical keys) / {cache_stats['url_misses']} misses, "
+                           f"{cache_stats['image_hits']} download hits / {cache_stats['image_misses']} misses")
                 
                 # 3. Send Email (The Courier)
                 if send_email_with_pdf(pdf_file, email):
@@ -0,0 +1,131 @@
+"""
+Micro-benchmarks for the PDF image pipeline.
+
+    python benchmarks/bench_images.py            # all cases
+    python benchmarks/bench_images.py decode     # one group
+
+Every case runs in its own subprocess so peak RSS (ru_maxrss) reflects that
+case alone. The source JPEG is synthesised once by the parent and handed to
+each case as a file, so no network access is needed.
+"""
+
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from io import BytesIO
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+ITERATIONS = 50
+SOURCE_SIZE = (1080, 720)   # Roughly what the "regular" Unsplash variant used to be
+TARGET_SIZE = (440, 330)    # 4x3 inch frame at the screen profile
+QUALITY = 70
+
+
+def make_jpeg(size=SOURCE_SIZE):
+    from PIL import Image
+
+    # Noise + gradient + fractal so the codec has real detail to chew on
+    red = Image.effect_noise(size, 64)
+    green = Image.linear_gradient("L").resize(size)
+    blue = Image.effect_mandelbrot(size, (-2.0, -1.2, 1.0, 1.2), 64)
+    out = BytesIO()
+    Image.merge("RGB", (red, green, blue)).save(out, format="JPEG", quality=90)
+    return out.getvalue()
+
+
+# ---------------- CASES ---------------- #
+
+def decode_full(data, path):
+    """The original download_image + create_pdf path: full decode, then thumbnail."""
+    from PIL import Image
+
+    img = Image.open(BytesIO(data)).convert("RGB")
+    img.thumbnail(TARGET_SIZE)
+    out = BytesIO()
+    img.save(out, format="JPEG", quality=QUALITY)
+    return out.getvalue()
+
+
+def decode_draft(data, path):
+    from images import normalize_image
+
+    return normalize_image(data, TARGET_SIZE, QUALITY)
+
+
+def _draw_on_page(flowable):
+    from reportlab.lib.pagesizes import A4
+    from reportlab.pdfgen.canvas import Canvas
+
+    canvas = Canvas(BytesIO(), pagesize=A4)
+    flowable.wrapOn(canvas, A4[0], A4[1])
+    flowable.drawOn(canvas, 0, 0)
+    canvas.save()
+
+
+def layout_rlimage(data, path):
+    """The original create_stop_table path: Image(BytesIO) measured for aspect, then drawn."""
+    from reportlab.lib.units import inch
+    from reportlab.platypus import Image as ReportLabImage
+
+    img = ReportLabImage(BytesIO(data))
+    aspect = img.imageHeight / img.imageWidth
+    img.drawWidth = 2.8 * inch
+    img.drawHeight = 2.8 * inch * aspect
+    _draw_on_page(img)
+
+
+def layout_prepared(data, path):
+    from reportlab.lib.units import inch
+    from images import EmbeddedImage, PreparedImage
+
+    _draw_on_page(EmbeddedImage(PreparedImage(path, *SOURCE_SIZE), 2.8 * inch))
+
+
+CASES = {
+    "decode": {"full": decode_full, "draft": decode_draft},
+    "layout": {"rlimage": layout_rlimage, "prepared": layout_prepared},
+}
+
+
+def _max_rss_kb():
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss // 1024 if sys.platform == "darwin" else rss
+
+
+def run_case(group, name, path):
+    import images  # noqa: F401  Load PIL/ReportLab before taking the RSS baseline
+
+    func = CASES[group][name]
+    with open(path, "rb") as f:
+        data = f.read()
+    rss_before = _max_rss_kb()
+    func(data, path)  # Warm codec tables; its allocations still count towards the peak
+    cpu_start = time.process_time()
+    for _ in range(ITERATIONS):
+        func(data, path)
+    cpu_ms = (time.process_time() - cpu_start) * 1000 / ITERATIONS
+    print(f"{group:<8} {name:<10} {cpu_ms:8.2f} ms/image  peak +{_max_rss_kb() - rss_before:6d} KB")
+
+
+def main(argv):
+    if len(argv) == 4 and argv[0] == "--case":
+        run_case(argv[1], argv[2], argv[3])
+        return
+    groups = argv or list(CASES)
+    with tempfile.NamedTemporaryFile(suffix=".jpg", delete=False) as f:
+        f.write(make_jpeg())
+    try:
+        print(f"{ITERATIONS} iterations, {SOURCE_SIZE[0]}x{SOURCE_SIZE[1]} source -> {TARGET_SIZE[0]}x{TARGET_SIZE[1]}")
+        for group in groups:
+            for name in CASES[group]:
+                subprocess.run([sys.executable, __file__, "--case", group, name, f.name], check=True)
+    finally:
+        os.remove(f.name)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,168 @@
+"""
+Canonical forms for cache keys.
+
+Raw form input misses the caches on differences nobody cares about: "paris",
+"Paris " and "Paris, France" are one trip, a $5,000 and a $5,500 budget get
+the same kind of itinerary, and "Louvre - Morning" is the same photo as
+"Louvre". Everything that builds an itinerary or image cache key goes
+through here. Canonical values are only ever used for keys; prompts and
+search requests keep what the user typed.
+"""
+
+import re
+
+# Common alternate names -> canonical city. Keys are already in canonical text form.
+CITY_ALIASES = {
+    "nyc": "new york",
+    "new york city": "new york",
+    "manhattan": "new york",
+    "la": "los angeles",
+    "sf": "san francisco",
+    "san fran": "san francisco",
+    "dc": "washington",
+    "washington dc": "washington",
+    "bombay": "mumbai",
+    "calcutta": "kolkata",
+    "madras": "chennai",
+    "bangalore": "bengaluru",
+    "peking": "beijing",
+    "saigon": "ho chi minh city",
+    "rome italy": "rome",
+    "roma": "rome",
+    "firenze": "florence",
+    "venezia": "venice",
+    "praha": "prague",
+    "wien": "vienna",
+    "munchen": "munich",
+    "münchen": "munich",
+    "lisboa": "lisbon",
+    "kyoto japan": "kyoto",
+    "tokyo japan": "tokyo",
+    "dubai uae": "dubai",
+    "singapore city": "singapore",
+}
+
+# Country aliases -> one canonical name, for qualifiers like "Dubai, UAE"
+COUNTRY_ALIASES = {
+    "usa": "united states",
+    "us": "united states",
+    "united states of america": "united states",
+    "america": "united states",
+    "uk": "united kingdom",
+    "england": "united kingdom",
+    "great britain": "united kingdom",
+    "uae": "united arab emirates",
+    "holland": "netherlands",
+    "the netherlands": "netherlands",
+    "czechia": "czech republic",
+}
+
+# Qualifiers that only repeat where a city already is ("Paris, France"), so they can be
+# dropped from its key. Any other qualifier stays: "Paris, Texas" is a different trip.
+CITY_REGIONS = {
+    "paris": {"france", "ile de france", "île de france"},
+    "london": {"united kingdom"},
+    "rome": {"italy", "lazio"},
+    "florence": {"italy", "tuscany"},
+    "venice": {"italy", "veneto"},
+    "milan": {"italy", "lombardy"},
+    "barcelona": {"spain", "catalonia"},
+    "madrid": {"spain"},
+    "lisbon": {"portugal"},
+    "amsterdam": {"netherlands"},
+    "berlin": {"germany"},
+    "munich": {"germany", "bavaria"},
+    "vienna": {"austria"},
+    "prague": {"czech republic"},
+    "athens": {"greece"},
+    "istanbul": {"turkey", "türkiye"},
+    "dubai": {"united arab emirates"},
+    "tokyo": {"japan"},
+    "kyoto": {"japan"},
+    "beijing": {"china"},
+    "shanghai": {"china"},
+    "hong kong": {"china"},
+    "singapore": {"singapore"},
+    "bangkok": {"thailand"},
+    "bali": {"indonesia"},
+    "ho chi minh city": {"vietnam"},
+    "sydney": {"australia", "nsw", "new south wales"},
+    "mumbai": {"india", "maharashtra"},
+    "delhi": {"india"},
+    "new delhi": {"india", "delhi"},
+    "kolkata": {"india", "west bengal"},
+    "chennai": {"india", "tamil nadu"},
+    "bengaluru": {"india", "karnataka"},
+    "hyderabad": {"india", "telangana"},
+    "goa": {"india"},
+    "new york": {"united states", "ny", "new york", "new york state"},
+    "los angeles": {"united states", "ca", "california"},
+    "san francisco": {"united states", "ca", "california"},
+    "washington": {"united states", "dc", "d c", "district of columbia"},
+    "chicago": {"united states", "il", "illinois"},
+    "miami": {"united states", "fl", "florida"},
+    "las vegas": {"united states", "nv", "nevada"},
+    "toronto": {"canada", "ontario"},
+    "mexico city": {"mexico"},
+}
+
+# Upper bounds (USD, exclusive) of each budget tier
+BUDGET_TIERS = (1500, 3000, 6000, 12000, 25000, 50000)
+
+_TIME_OF_DAY = r"(?:early |late )?(?:morning|afternoon|evening|night|sunrise|sunset|breakfast|brunch|lunch|dinner)"
+_SUFFIX_RE = re.compile(r"\s*(?:[-–—:|]\s*|\(\s*|\[\s*)" + _TIME_OF_DAY + r"\s*[)\]]?\s*$", re.IGNORECASE)
+_PREFIX_RE = re.compile(r"^\s*" + _TIME_OF_DAY + r"\s*[-–—:|]\s*", re.IGNORECASE)
+_PUNCT_RE = re.compile(r"[^\w\s]", re.UNICODE)
+
+
+def canonical_text(text):
+    """Case-fold, drop punctuation and collapse whitespace."""
+    return " ".join(_PUNCT_RE.sub(" ", (text or "").casefold()).split())
+
+
+def canonical_city(name):
+    """'Paris, France' / ' paris ' / 'PARIS' -> 'paris', but 'Paris, Texas' -> 'paris, texas'.
+
+    Known aliases are folded too. A qualifier after a comma is only dropped
+    when CITY_REGIONS lists it as the city's own region or country.
+    """
+    text = canonical_text(name)
+    if text in CITY_ALIASES:
+        return CITY_ALIASES[text]
+    city, *qualifiers = [canonical_text(part) for part in (name or "").split(",")]
+    city = CITY_ALIASES.get(city, city)
+    home = CITY_REGIONS.get(city, ())
+    qualifiers = [COUNTRY_ALIASES.get(qualifier, qualifier) for qualifier in qualifiers if qualifier]
+    return ", ".join([city] + [qualifier for qualifier in qualifiers if qualifier not in home])
+
+
+def budget_tier(budget):
+    """Bucket a numeric USD budget into a tier label; non-numeric tiers are just case-folded."""
+    if isinstance(budget, str):
+        return canonical_text(budget)
+    for upper in BUDGET_TIERS:
+        if budget < upper:
+            return f"under-{upper}"
+    return f"over-{BUDGET_TIERS[-1]}"
+
+
+def strip_time_of_day(name):
+    """'Louvre - Morning' / 'Morning: Louvre' / 'Louvre (Evening)' -> 'Louvre'."""
+    stripped = _PREFIX_RE.sub("", _SUFFIX_RE.sub("", name or ""))
+    return stripped.strip() or (name or "").strip()
+
+
+def canonical_query(query):
+    """Canonical image search key."""
+    return canonical_text(strip_time_of_day(query))
+
+
+def canonical_itinerary_request(source, destination, days, budget, travelers, vibe):
+    return {
+        "source": canonical_city(source),
+        "destination": canonical_city(destination),
+        "days": int(days),
+        "budget": budget_tier(budget),
+        "travelers": int(travelers),
+        "vibe": canonical_text(vibe),
+    }
@@ -0,0 +1,179 @@
+"""
+Process-wide network clients shared by both entry points.
+
+Streamlit re-executes the app script on every interaction, but imported
+modules are only loaded once per process, so clients created here keep
+their connection pools warm across reruns and sessions.
+"""
+
+import os
+import threading
+import time
+from urllib.parse import urlsplit
+
+import httpx
+import requests
+from openai import OpenAI
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# Sized for one PDF's worth of concurrent image fetches per host
+HTTP_POOL_CONNECTIONS = 4
+HTTP_POOL_MAXSIZE = 16
+HTTP_RETRIES = 3
+HTTP_BACKOFF_FACTOR = 0.5
+# Longest Retry-After we will sleep for; the request is blocking a Streamlit rerun
+HTTP_MAX_RETRY_AFTER_SECONDS = 5
+
+# Consecutive failures before a host is short-circuited, and how long it stays open
+CIRCUIT_FAILURE_THRESHOLD = 5
+CIRCUIT_RESET_SECONDS = 60
+
+# OpenAI: a few long-lived completions at a time per process, kept warm between users
+OPENAI_MAX_CONNECTIONS = 20
+OPENAI_MAX_KEEPALIVE = 10
+OPENAI_KEEPALIVE_SECONDS = 120
+OPENAI_CONNECT_TIMEOUT = 10
+OPENAI_READ_TIMEOUT = 120
+# openai retries dropped connections, timeouts and 429/5xx. Tiered itinerary calls turn
+# this off (see tier_client) so a timeout falls through to the next tier at once
+OPENAI_MAX_RETRIES = 1
+
+_session = None
+_session_lock = threading.Lock()
+
+
+class _CappedRetry(Retry):
+    """Retry that honours Retry-After, but never sleeps longer than HTTP_MAX_RETRY_AFTER_SECONDS."""
+
+    def get_retry_after(self, response):
+        retry_after = super().get_retry_after(response)
+        if retry_after is None:
+            return None
+        return min(retry_after, HTTP_MAX_RETRY_AFTER_SECONDS)
+
+
+def _build_session():
+    retry = _CappedRetry(
+        total=HTTP_RETRIES,
+        backoff_factor=HTTP_BACKOFF_FACTOR,
+        status_forcelist=(429, 500, 502, 503, 504),
+        allowed_methods=frozenset(["GET", "HEAD"]),
+        respect_retry_after_header=True,
+    )
+    adapter = HTTPAdapter(
+        pool_connections=HTTP_POOL_CONNECTIONS,
+        pool_maxsize=HTTP_POOL_MAXSIZE,
+        max_retries=retry,
+    )
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def get_http_session():
+    """Keep-alive requests.Session with pooling and retry/backoff, one per process."""
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = _build_session()
+        return _session
+
+
+_openai_clients = {}
+_openai_lock = threading.Lock()
+
+
+def get_openai_client(api_key=None):
+    """One pooled OpenAI client per API key (default OPENAI_API_KEY), shared by every session in the process.
+
+    Building a client per call (or per Streamlit rerun) throws away its
+    connection pool, so every request paid for a fresh TLS handshake.
+    """
+    api_key = api_key or os.getenv("OPENAI_API_KEY")
+    with _openai_lock:
+        if api_key not in _openai_clients:
+            http_client = httpx.Client(
+                limits=httpx.Limits(
+                    max_connections=OPENAI_MAX_CONNECTIONS,
+                    max_keepalive_connections=OPENAI_MAX_KEEPALIVE,
+                    keepalive_expiry=OPENAI_KEEPALIVE_SECONDS,
+                ),
+                timeout=httpx.Timeout(OPENAI_READ_TIMEOUT, connect=OPENAI_CONNECT_TIMEOUT),
+            )
+            _openai_clients[api_key] = OpenAI(api_key=api_key, http_client=http_client,
+                                              max_retries=OPENAI_MAX_RETRIES)
+        return _openai_clients[api_key]
+
+
+def tier_client(api_key=None):
+    """The shared OpenAI client without retries, for calls bounded by a model tier's timeout."""
+    return get_openai_client(api_key).with_options(max_retries=0)
+
+
+# ---------------- CIRCUIT BREAKER ---------------- #
+
+class CircuitOpenError(requests.RequestException):
+    """Raised instead of calling a host whose circuit is open."""
+
+
+class CircuitBreaker:
+    """Per-host breaker: opens after consecutive failures, then lets one trial through."""
+
+    def __init__(self, threshold=CIRCUIT_FAILURE_THRESHOLD, reset_after=CIRCUIT_RESET_SECONDS):
+        self.threshold = threshold
+        self.reset_after = reset_after
+        self.failures = 0
+        self.opened_at = None
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if time.monotonic() - self.opened_at >= self.reset_after:
+                # Half-open: restart the clock so only this caller probes the host
+                self.opened_at = time.monotonic()
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.failures >= self.threshold:
+                self.opened_at = time.monotonic()
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_circuit_breaker(host):
+    with _breakers_lock:
+        if host not in _breakers:
+            _breakers[host] = CircuitBreaker()
+        return _breakers[host]
+
+
+def guarded_get(url, **kwargs):
+    """GET through the shared session, failing fast while the host's circuit is open."""
+    host = urlsplit(url).hostname
+    breaker = get_circuit_breaker(host)
+    if not breaker.allow():
+        raise CircuitOpenError(f"Circuit open for {host}")
+    try:
+        response = get_http_session().get(url, **kwargs)
+    except requests.RequestException:
+        breaker.record_failure()
+        raise
+    if response.status_code == 429 or response.status_code >= 500:
+        breaker.record_failure()
+    else:
+        breaker.record_success()
+    return response
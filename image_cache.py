@@ -0,0 +1,310 @@
+"""
+Persistent on-disk cache for Unsplash lookups and downloaded images.
+
+Layout under the cache root:
+    entries/<sha256 of key>.json   small JSON records (query -> url, url -> blob)
+    blobs/<sha256 of bytes>        image bytes, stored once per unique content
+
+Every write goes to a temp file and is moved into place with os.replace, so
+several Streamlit worker processes can share one directory without readers
+ever seeing a half-written file. Blob mtimes double as "last used" stamps
+for LRU eviction once the byte budget is exceeded; entry mtimes do the same
+for dropping records that have not been used in ENTRY_MAX_AGE_SECONDS.
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+
+from canonical import canonical_query
+
+try:
+    import fcntl
+except ImportError:  # Windows: eviction simply isn't serialised across processes
+    fcntl = None
+
+DEFAULT_CACHE_DIR = ".image_cache"
+DEFAULT_MAX_BYTES = 500 * 1024 * 1024
+
+# How long a known-bad query/URL is skipped before it is tried again
+NO_RESULTS_TTL_SECONDS = 6 * 60 * 60
+FAILED_DOWNLOAD_TTL_SECONDS = 10 * 60
+
+# Embeddable JPEGs used this recently are never evicted: a PDF being built
+# (possibly by another session) holds their paths and reads them at the end
+EMBEDDABLE_GRACE_SECONDS = 15 * 60
+
+# Entry records unused this long are dropped, as are expired negative markers and
+# records whose blob is gone; the entries directory is swept at most once per interval
+ENTRY_MAX_AGE_SECONDS = 30 * 24 * 60 * 60
+ENTRY_SWEEP_INTERVAL_SECONDS = 60 * 60
+
+
+def normalize_query(query):
+    """Cache key form of a search query; see canonical.canonical_query."""
+    return canonical_query(query)
+
+
+def _key_hash(key):
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+
+def atomic_write(path, data):
+    """Write bytes via a temp file in the same directory and os.replace it into place."""
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+class ImageCache:
+    def __init__(self, root=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.entries_dir = os.path.join(root, "entries")
+        self.blobs_dir = os.path.join(root, "blobs")
+        os.makedirs(self.entries_dir, exist_ok=True)
+        os.makedirs(self.blobs_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._stats = {"url_hits": 0, "url_misses": 0, "image_hits": 0, "image_misses": 0, "negative_hits": 0,
+                       "url_hits_canonical_only": 0}
+
+    # ---------------- LOW-LEVEL IO ---------------- #
+
+    def _read_entry(self, key):
+        try:
+            with open(os.path.join(self.entries_dir, _key_hash(key) + ".json"), "rb") as f:
+                return json.loads(f.read())
+        except (OSError, ValueError):
+            return None
+
+    def _write_entry(self, key, record):
+        path = os.path.join(self.entries_dir, _key_hash(key) + ".json")
+        atomic_write(path, json.dumps(record).encode("utf-8"))
+
+    def _touch_entry(self, key):
+        try:
+            os.utime(os.path.join(self.entries_dir, _key_hash(key) + ".json"))
+        except OSError:
+            pass
+
+    def _count(self, name):
+        with self._lock:
+            self._stats[name] += 1
+
+    # ---------------- PUBLIC API ---------------- #
+
+    def lookup_url(self, query):
+        """Return the previously resolved image URL for a search query, or None."""
+        record = self._read_entry("query:" + normalize_query(query))
+        if record and record.get("url"):
+            self._touch_entry("query:" + normalize_query(query))
+            self._count("url_hits")
+            if record.get("query") != query:
+                # Would have missed if keyed on the raw query string
+                self._count("url_hits_canonical_only")
+            return record["url"]
+        self._count("url_misses")
+        return None
+
+    def store_url(self, query, url):
+        self._write_entry("query:" + normalize_query(query), {"query": query, "url": url})
+
+    def image_path(self, url):
+        """Return the blob path holding a URL's image, or None.
+
+        Lets callers decode straight from disk instead of loading the bytes.
+        """
+        record = self._read_entry("url:" + url)
+        if record and record.get("sha256"):
+            path = os.path.join(self.blobs_dir, record["sha256"])
+            try:
+                os.utime(path)  # Mark as recently used for LRU
+                self._touch_entry("url:" + url)
+                self._count("image_hits")
+                return path
+            except OSError:
+                pass  # Evicted by this or another process
+        self._count("image_misses")
+        return None
+
+    def load_image(self, url):
+        """Return cached image bytes for a URL, or None."""
+        path = self.image_path(url)
+        if path:
+            try:
+                with open(path, "rb") as f:
+                    return f.read()
+            except OSError:
+                pass
+        return None
+
+    def store_image_stream(self, url, chunks):
+        """Write an iterable of byte chunks to a blob, hashing as it goes.
+
+        Only one chunk is in memory at a time. If the iterable raises (e.g. a
+        size cap is hit) the partial temp file is discarded. Returns the blob path.
+        """
+        digest = hashlib.sha256()
+        fd, tmp_path = tempfile.mkstemp(dir=self.blobs_dir, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                for chunk in chunks:
+                    digest.update(chunk)
+                    f.write(chunk)
+            path = os.path.join(self.blobs_dir, digest.hexdigest())
+            if os.path.exists(path):
+                os.remove(tmp_path)
+                os.utime(path)
+            else:
+                os.replace(tmp_path, path)
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+        self._write_entry("url:" + url, {"url": url, "sha256": digest.hexdigest()})
+        self.evict()
+        return path
+
+    def store_image(self, url, data):
+        """Store image bytes under their content hash and point the URL at them."""
+        return self.store_image_stream(url, [data])
+
+    def store_embeddable(self, data):
+        """Write ready-to-embed JPEG bytes to <sha256>.jpg and return the path.
+
+        ReportLab names an image XObject after the file path it was given and
+        embeds .jpg files without decoding them, so handing every flowable the
+        content-addressed path means identical images are written into a PDF
+        once and referenced from each place they appear.
+        """
+        path = os.path.join(self.blobs_dir, hashlib.sha256(data).hexdigest() + ".jpg")
+        if os.path.exists(path):
+            os.utime(path)
+        else:
+            atomic_write(path, data)
+        return path
+
+    def mark_failed(self, kind, key, ttl):
+        """Remember that a query ("query") or URL ("url") failed, for ttl seconds."""
+        if kind == "query":
+            key = normalize_query(key)
+        self._write_entry(f"failed:{kind}:{key}", {"key": key, "expires": time.time() + ttl})
+
+    def is_failed(self, kind, key):
+        if kind == "query":
+            key = normalize_query(key)
+        record = self._read_entry(f"failed:{kind}:{key}")
+        if record and record.get("expires", 0) > time.time():
+            self._count("negative_hits")
+            return True
+        return False
+
+    def evict(self):
+        """Delete least recently used blobs until the cache fits its byte budget, then sweep stale entries.
+
+        Embeddables (<sha256>.jpg) touched within EMBEDDABLE_GRACE_SECONDS
+        still count towards the budget but are not deleted.
+        """
+        lock_file = open(os.path.join(self.root, ".evict.lock"), "a")
+        try:
+            if fcntl is not None:
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError:
+                    return  # Another process is already evicting
+            self._evict_blobs()
+            self._sweep_entries()
+        finally:
+            lock_file.close()
+
+    def _evict_blobs(self):
+        blobs = []
+        total = 0
+        for entry in os.scandir(self.blobs_dir):
+            if entry.name.startswith(".tmp-"):
+                continue
+            try:
+                info = entry.stat()
+            except OSError:
+                continue
+            blobs.append((info.st_mtime, info.st_size, entry.path))
+            total += info.st_size
+        if total <= self.max_bytes:
+            return
+        grace_cutoff = time.time() - EMBEDDABLE_GRACE_SECONDS
+        for mtime, size, path in sorted(blobs):
+            if path.endswith(".jpg") and mtime > grace_cutoff:
+                continue
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            if total <= self.max_bytes:
+                break
+
+    def _sweep_entries(self):
+        """Delete entries that can no longer hit, at most once per ENTRY_SWEEP_INTERVAL_SECONDS.
+
+        That is entries unused for ENTRY_MAX_AGE_SECONDS, expired negative
+        markers, and URL records whose blob has been evicted.
+        """
+        marker = os.path.join(self.root, ".entries.swept")
+        now = time.time()
+        try:
+            if now - os.stat(marker).st_mtime < ENTRY_SWEEP_INTERVAL_SECONDS:
+                return
+        except OSError:
+            pass  # Never swept
+        with open(marker, "a"):
+            os.utime(marker)
+        cutoff = now - ENTRY_MAX_AGE_SECONDS
+        for entry in os.scandir(self.entries_dir):
+            if entry.name.startswith(".tmp-"):
+                continue
+            try:
+                stale = entry.stat().st_mtime < cutoff
+                if not stale:
+                    with open(entry.path, "rb") as f:
+                        record = json.loads(f.read())
+                    if "expires" in record:
+                        stale = record["expires"] <= now
+                    elif record.get("sha256"):
+                        stale = not os.path.exists(os.path.join(self.blobs_dir, record["sha256"]))
+                if stale:
+                    os.remove(entry.path)
+            except (OSError, ValueError):
+                continue
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats)
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_image_cache():
+    """Process-wide cache, configured from IMAGE_CACHE_DIR / IMAGE_CACHE_MAX_BYTES."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = ImageCache(
+                root=os.getenv("IMAGE_CACHE_DIR", DEFAULT_CACHE_DIR),
+                max_bytes=int(os.getenv("IMAGE_CACHE_MAX_BYTES", DEFAULT_MAX_BYTES)),
+            )
+        return _cache
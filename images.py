@@ -0,0 +1,183 @@
+"""
+Helpers for sizing and preparing stop images for the PDF builders.
+
+Unsplash serves photos through an imgix CDN, which will resize, crop and
+re-encode on the edge. Asking it for exactly the pixels a flowable needs is
+far cheaper than downloading a 1080px original and shrinking it locally.
+"""
+
+import math
+import os
+from collections import namedtuple
+from io import BytesIO
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+from PIL import Image
+from reportlab.graphics.shapes import Drawing, Rect, String
+from reportlab.lib import colors
+from reportlab.platypus import Flowable
+
+from clients import guarded_get
+from image_cache import get_image_cache
+
+# Pixel density and JPEG quality per output target
+DPI_PROFILES = {
+    "screen": {"dpi": 110, "quality": 70},
+    "print": {"dpi": 300, "quality": 85},
+}
+DEFAULT_DPI_PROFILE = os.getenv("IMAGE_DPI_PROFILE", "screen")
+
+# Wall-clock budget for all image work in one PDF; late stops get a placeholder
+IMAGE_PHASE_BUDGET_SECONDS = float(os.getenv("IMAGE_PHASE_BUDGET_SECONDS", 8))
+
+# Hard cap on a single download; a render-sized photo is well under 1 MB
+MAX_IMAGE_BYTES = int(os.getenv("IMAGE_MAX_BYTES", 8 * 1024 * 1024))
+DOWNLOAD_CHUNK_BYTES = 64 * 1024
+
+UNSPLASH_CDN_HOSTS = ("images.unsplash.com", "plus.unsplash.com")
+
+# imgix parameters we set ourselves; anything else on the URL (ixid, ixlib) is kept
+_SIZING_PARAMS = ("w", "h", "q", "fm", "fit", "crop", "dpr", "auto", "cs")
+
+
+# A normalised JPEG on disk plus its pixel size, measured once while normalising
+PreparedImage = namedtuple("PreparedImage", "path width height")
+
+
+class ImageTooLargeError(ValueError):
+    """The image exceeds MAX_IMAGE_BYTES, by Content-Length or while streaming."""
+
+
+def is_unsplash_cdn(url):
+    return urlsplit(url).hostname in UNSPLASH_CDN_HOSTS
+
+
+def render_size(width_pt, height_pt=None, profile=None):
+    """Pixel size needed to fill width_pt x height_pt (ReportLab points) at the profile's DPI."""
+    dpi = DPI_PROFILES[profile or DEFAULT_DPI_PROFILE]["dpi"]
+    width_px = max(1, math.ceil(width_pt / 72 * dpi))
+    if height_pt is None:
+        return width_px, None
+    return width_px, max(1, math.ceil(height_pt / 72 * dpi))
+
+
+def sized_image_url(url, width_pt, height_pt=None, profile=None, fmt="jpg"):
+    """Rewrite an Unsplash CDN URL to return exactly the pixels a flowable needs.
+
+    With a height the CDN crops to that aspect ratio; without one it keeps the
+    photo's own ratio. Non-CDN URLs are returned unchanged.
+    """
+    if not is_unsplash_cdn(url):
+        return url
+
+    settings = DPI_PROFILES[profile or DEFAULT_DPI_PROFILE]
+    width_px, height_px = render_size(width_pt, height_pt, profile)
+
+    parts = urlsplit(url)
+    params = [(k, v) for k, v in parse_qsl(parts.query) if k not in _SIZING_PARAMS]
+    params += [("w", str(width_px)), ("q", str(settings["quality"])), ("fm", fmt)]
+    if height_px is not None:
+        params += [("h", str(height_px)), ("fit", "crop"), ("crop", "entropy")]
+    return urlunsplit(parts._replace(query=urlencode(params)))
+
+
+def download_to_cache(url, timeout=15, max_bytes=MAX_IMAGE_BYTES):
+    """Stream an image into the on-disk cache and return its blob path.
+
+    Content-Length is checked before the body is read, and the running total
+    is checked per chunk, so an oversized response costs at most one chunk
+    of memory. Returns None for non-200 responses.
+    """
+    cache = get_image_cache()
+    path = cache.image_path(url)
+    if path:
+        return path
+
+    with guarded_get(url, stream=True, timeout=timeout) as response:
+        if response.status_code != 200:
+            return None
+        length = response.headers.get("Content-Length")
+        if length and length.isdigit() and int(length) > max_bytes:
+            raise ImageTooLargeError(f"{url} is {length} bytes (limit {max_bytes})")
+
+        def chunks():
+            total = 0
+            for chunk in response.iter_content(DOWNLOAD_CHUNK_BYTES):
+                total += len(chunk)
+                if total > max_bytes:
+                    raise ImageTooLargeError(f"{url} exceeded {max_bytes} bytes")
+                yield chunk
+
+        return cache.store_image_stream(url, chunks())
+
+
+def normalize_image(source, size, quality):
+    """Return JPEG bytes no larger than size, ready to embed in a PDF."""
+    return _normalize(source, size, quality)[0]
+
+
+def _normalize(source, size, quality):
+    """Shared body of normalize_image/prepare_embeddable; also returns (width, height).
+
+    source is a file path or bytes; decoding from a path reads the file
+    incrementally rather than loading it whole. JPEGs are decoded with
+    draft() at the smallest 1/2, 1/4 or 1/8 scale that still covers size, so
+    a 1080px photo headed for a 440px frame never gets fully decoded. EXIF
+    and ICC data are dropped. Images that are already a small, metadata-free
+    JPEG are returned byte-for-byte.
+    """
+    with Image.open(BytesIO(source) if isinstance(source, bytes) else source) as img:
+        if (img.format == "JPEG" and img.mode in ("RGB", "L")
+                and img.width <= size[0] and img.height <= size[1]
+                and "exif" not in img.info and "icc_profile" not in img.info):
+            if isinstance(source, bytes):
+                return source, img.size
+            with open(source, "rb") as f:
+                return f.read(), img.size
+
+        if img.format == "JPEG":
+            # Must happen before anything loads the pixels (convert() would)
+            img.draft("RGB", size)
+        rgb = img.convert("RGB")
+    rgb.thumbnail(size)
+
+    out = BytesIO()
+    rgb.save(out, format="JPEG", quality=quality)  # No exif/icc_profile passed, so none written
+    return out.getvalue(), rgb.size
+
+
+def prepare_embeddable(source, size, quality):
+    """Normalise an image and store it content-addressed; returns a PreparedImage."""
+    jpeg, (width, height) = _normalize(source, size, quality)
+    return PreparedImage(get_image_cache().store_embeddable(jpeg), width, height)
+
+
+class EmbeddedImage(Flowable):
+    """Draws a PreparedImage at a size fixed up front.
+
+    Unlike platypus.Image it never opens the file to measure it: the aspect
+    ratio comes from the PreparedImage, and the JPEG is only read once, when
+    the canvas embeds it. Give just a width to keep the photo's aspect ratio.
+    """
+
+    def __init__(self, image, width, height=None):
+        super().__init__()
+        self.image = image
+        self.drawWidth = width
+        self.drawHeight = height if height is not None else width * image.height / image.width
+
+    def wrap(self, availWidth, availHeight):
+        return self.drawWidth, self.drawHeight
+
+    def draw(self):
+        self.canv.drawImage(self.image.path, 0, 0, self.drawWidth, self.drawHeight)
+
+
+def image_placeholder(width_pt, height_pt, label="Photo unavailable"):
+    """Lightweight vector stand-in for a stop photo that couldn't be fetched."""
+    drawing = Drawing(width_pt, height_pt)
+    drawing.add(Rect(0, 0, width_pt, height_pt, rx=6, ry=6,
+                     fillColor=colors.HexColor("#ECEFF1"), strokeColor=colors.HexColor("#B0BEC5")))
+    drawing.add(String(width_pt / 2, height_pt / 2 - 4, label, textAnchor="middle",
+                       fontName="Helvetica-Oblique", fontSize=10, fillColor=colors.HexColor("#607D8B")))
+    return drawing
@@ -0,0 +1,114 @@
+"""
+Persistent cache for LLM responses.
+
+A GPT-4 itinerary takes 20-60 seconds and costs real money, yet the same
+(source, destination, days, budget, travelers, vibe) is requested again and
+again. Responses are stored as one JSON file per key, written atomically so
+several Streamlit processes can share the directory. Keys include a hash of
+the prompt template and model settings, so editing the prompt or switching
+models never serves stale output.
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+
+from image_cache import atomic_write
+
+DEFAULT_CACHE_DIR = ".llm_cache"
+DEFAULT_TTL_SECONDS = 7 * 24 * 60 * 60
+DEFAULT_MAX_ENTRIES = 500
+
+
+def make_key(request, **fingerprint):
+    """Stable key for a request dict plus whatever shapes the output (template, model, ...).
+
+    Long strings such as prompt templates are hashed so the key stays short.
+    """
+    fingerprint = {
+        name: hashlib.sha256(value.encode("utf-8")).hexdigest() if isinstance(value, str) else value
+        for name, value in fingerprint.items()
+    }
+    payload = json.dumps({"request": request, "fingerprint": fingerprint}, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    def __init__(self, root=DEFAULT_CACHE_DIR, ttl=DEFAULT_TTL_SECONDS, max_entries=DEFAULT_MAX_ENTRIES):
+        self.root = root
+        self.ttl = ttl
+        self.max_entries = max_entries
+        os.makedirs(root, exist_ok=True)
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "canonical_only_hits": 0}
+
+    def _path(self, key):
+        return os.path.join(self.root, key + ".json")
+
+    def _count(self, name):
+        with self._lock:
+            self._stats[name] += 1
+
+    def get(self, key, ttl=None, raw=None):
+        """Return the cached value for key, or None if missing or older than ttl.
+
+        raw is the un-canonicalised request; hits whose stored raw request
+        differs are counted as canonical_only_hits, i.e. hits that keying on
+        raw input would have missed.
+        """
+        try:
+            with open(self._path(key), "rb") as f:
+                record = json.loads(f.read())
+        except (OSError, ValueError):
+            record = None
+        if record and time.time() - record["stored_at"] <= (ttl or self.ttl):
+            self._count("hits")
+            if raw is not None and record.get("raw") != raw:
+                self._count("canonical_only_hits")
+            return record["value"]
+        self._count("misses")
+        return None
+
+    def put(self, key, value, raw=None):
+        record = {"stored_at": time.time(), "raw": raw, "value": value}
+        atomic_write(self._path(key), json.dumps(record).encode("utf-8"))
+        self.evict()
+
+    def evict(self):
+        """Drop the oldest entries beyond max_entries."""
+        entries = []
+        for entry in os.scandir(self.root):
+            if not entry.name.endswith(".json"):
+                continue
+            try:
+                entries.append((entry.stat().st_mtime, entry.path))
+            except OSError:
+                continue
+        for _, path in sorted(entries)[:max(0, len(entries) - self.max_entries)]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass  # Another process got there first
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats)
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_response_cache():
+    """Process-wide cache, configured from LLM_CACHE_DIR / LLM_CACHE_TTL_SECONDS / LLM_CACHE_MAX_ENTRIES."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = ResponseCache(
+                root=os.getenv("LLM_CACHE_DIR", DEFAULT_CACHE_DIR),
+                ttl=int(os.getenv("LLM_CACHE_TTL_SECONDS", DEFAULT_TTL_SECONDS)),
+                max_entries=int(os.getenv("LLM_CACHE_MAX_ENTRIES", DEFAULT_MAX_ENTRIES)),
+            )
+        return _cache
@@ -0,0 +1,92 @@
+"""
+Cache for the destination-invariant parts of an itinerary.
+
+How to get from New York to Paris, what to pack for Paris and what Paris
+is like as a destination do not change with the number of days or the
+vibe, yet every itinerary prompt had the model write them again. Each such
+fragment is cached on its own, keyed only on the places it depends on and
+kept for its own TTL. When a fragment is cached the prompt leaves it out,
+so the model never writes it, and the cached text is spliced back in.
+"""
+
+import os
+import threading
+
+from canonical import canonical_city
+from llm_cache import DEFAULT_CACHE_DIR, ResponseCache, make_key
+
+DAY = 24 * 60 * 60
+
+# Fragment -> the request fields it depends on
+FRAGMENT_SCOPES = {
+    "getting_there": ("source", "destination"),
+    "travel_tips": ("destination",),
+    "destination_overview": ("destination",),
+}
+# Routes and seasonal advice go stale sooner than a description of the place
+FRAGMENT_TTL_SECONDS = {
+    "getting_there": 30 * DAY,
+    "travel_tips": 30 * DAY,
+    "destination_overview": 90 * DAY,
+}
+DEFAULT_MAX_ENTRIES = 2000
+# Used when a completion came back without usage
+DEFAULT_TOKENS_PER_CHAR = 0.26
+
+
+def fragment_tokens(fragment, content, completion_tokens):
+    """Completion tokens attributable to fragment, a slice of the completion content."""
+    per_char = completion_tokens / len(content) if completion_tokens and content else DEFAULT_TOKENS_PER_CHAR
+    return round(len(fragment) * per_char)
+
+
+class FragmentCache:
+    """get() / put() fragments by name and the places they depend on.
+
+    Each entry remembers how many completion tokens the model spent writing
+    it, which is what a hit saves.
+    """
+
+    def __init__(self, root, max_entries=DEFAULT_MAX_ENTRIES):
+        self._cache = ResponseCache(root=root, max_entries=max_entries)
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "tokens_saved": 0}
+
+    def key(self, name, template, source=None, destination=None):
+        """template is the prompt wording that produces the fragment, so editing it invalidates."""
+        places = {"source": canonical_city(source), "destination": canonical_city(destination)}
+        request = {"fragment": name, **{field: places[field] for field in FRAGMENT_SCOPES[name]}}
+        return make_key(request, template=template)
+
+    def get(self, name, template, source=None, destination=None):
+        """(value, completion tokens saved), or None when not cached or past the fragment's TTL."""
+        record = self._cache.get(self.key(name, template, source, destination), ttl=FRAGMENT_TTL_SECONDS[name])
+        with self._lock:
+            if record is None:
+                self._stats["misses"] += 1
+                return None
+            self._stats["hits"] += 1
+            self._stats["tokens_saved"] += record["tokens"]
+        return record["value"], record["tokens"]
+
+    def put(self, name, template, value, tokens, source=None, destination=None):
+        if not value:
+            return
+        self._cache.put(self.key(name, template, source, destination), {"value": value, "tokens": tokens})
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats)
+
+
+_fragments = None
+_fragments_lock = threading.Lock()
+
+
+def get_fragment_cache():
+    """Process-wide fragment cache, kept next to the LLM cache."""
+    global _fragments
+    with _fragments_lock:
+        if _fragments is None:
+            _fragments = FragmentCache(os.path.join(os.getenv("LLM_CACHE_DIR", DEFAULT_CACHE_DIR), "fragments"))
+        return _fragments
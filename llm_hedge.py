@@ -0,0 +1,222 @@
+"""
+Hedged LLM requests.
+
+Completion latency has a long tail: most itineraries take ~25 s, a few take
+well over a minute for no reason visible to us. When a request has been
+waiting longer than most recent requests took (a configurable percentile),
+an identical second request is sent and whichever answers first is used.
+Hedges cost a second completion, so at most max_rate of recent requests
+may be hedged. Hedging is off unless LLM_HEDGE=1; latencies are recorded
+either way so the percentile is ready when it is switched on.
+"""
+
+import os
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+HEDGE_ENABLED = os.getenv("LLM_HEDGE", "0") == "1"
+HEDGE_PERCENTILE = float(os.getenv("LLM_HEDGE_PERCENTILE", 90))
+HEDGE_MAX_RATE = float(os.getenv("LLM_HEDGE_MAX_RATE", 0.1))
+# No hedging until a call has this many latency samples to take a percentile of
+HEDGE_MIN_SAMPLES = 20
+LATENCY_WINDOW = 200
+RATE_WINDOW = 100
+
+
+class LatencyTracker:
+    """Recent latencies per call name, e.g. "gpt-4:stream"."""
+
+    def __init__(self, window=LATENCY_WINDOW):
+        self.window = window
+        self._samples = {}
+        self._lock = threading.Lock()
+
+    def record(self, name, seconds):
+        with self._lock:
+            self._samples.setdefault(name, deque(maxlen=self.window)).append(seconds)
+
+    def percentile(self, name, pct, min_samples=HEDGE_MIN_SAMPLES):
+        """pct-th percentile of name's recent latencies, or None with too few samples."""
+        with self._lock:
+            samples = sorted(self._samples.get(name, ()))
+        if len(samples) < min_samples:
+            return None
+        return samples[min(len(samples) - 1, int(len(samples) * pct / 100))]
+
+
+class HedgePolicy:
+    """When to hedge, how often it is allowed, and how it has gone."""
+
+    def __init__(self, enabled=HEDGE_ENABLED, percentile=HEDGE_PERCENTILE, max_rate=HEDGE_MAX_RATE,
+                 tracker=None):
+        self.enabled = enabled
+        self.percentile = percentile
+        self.max_rate = max_rate
+        self.tracker = tracker or LatencyTracker()
+        self._recent = deque(maxlen=RATE_WINDOW)  # Whether each recent request was hedged
+        self._lock = threading.Lock()
+        self._stats = {"requests": 0, "hedged": 0, "hedge_wins": 0, "capped": 0}
+
+    def delay(self, name):
+        """Seconds to wait before hedging a call to name, or None to never hedge it."""
+        if not self.enabled:
+            return None
+        return self.tracker.percentile(name, self.percentile)
+
+    def start(self):
+        with self._lock:
+            self._stats["requests"] += 1
+
+    def allow_hedge(self):
+        """Claim a hedge unless max_rate of the last RATE_WINDOW requests were already hedged."""
+        with self._lock:
+            if sum(self._recent) + 1 > self.max_rate * self._recent.maxlen:
+                self._stats["capped"] += 1
+                return False
+            self._stats["hedged"] += 1
+            return True
+
+    def finish(self, name, latency, hedged, hedge_won):
+        self.tracker.record(name, latency)
+        with self._lock:
+            self._recent.append(hedged)
+            if hedge_won:
+                self._stats["hedge_wins"] += 1
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats)
+
+
+def hedged_call(name, call, policy=None):
+    """Run call() and return its result, hedging with a second call() if it is slow.
+
+    Whichever call returns first wins. A call cannot be interrupted once
+    sent, so the loser is abandoned rather than cancelled (its completion is
+    still billed, which is what max_rate caps). If the first to finish
+    raised, the other one is still waited for.
+    """
+    policy = policy or get_hedge_policy()
+    policy.start()
+    started = time.monotonic()
+    pool = ThreadPoolExecutor(max_workers=2)
+    try:
+        attempts = {pool.submit(call): 0}
+        delay = policy.delay(name)
+        done, _ = wait(attempts, timeout=delay)
+        if not done and policy.allow_hedge():
+            attempts[pool.submit(call)] = 1
+        pending = set(attempts)
+        while True:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            failed = [future for future in done if future.exception()]
+            winners = [future for future in done if not future.exception()]
+            if winners:
+                winner = winners[0]
+                policy.finish(name, time.monotonic() - started, len(attempts) > 1, attempts[winner] == 1)
+                return winner.result()
+            if not pending:
+                policy.finish(name, time.monotonic() - started, len(attempts) > 1, False)
+                raise failed[0].exception()
+    finally:
+        pool.shutdown(wait=False)
+
+
+def hedged_stream(name, open_stream, is_first_token, policy=None):
+    """Iterate over a streamed completion, hedging if its first token is slow.
+
+    open_stream() starts a streamed request; is_first_token(chunk) says
+    whether a chunk carries generated text. If none has arrived after the
+    hedge delay, a second stream is opened. The first stream to deliver a
+    token wins and the other is closed, which aborts its HTTP request.
+    Streams are raced on their first token rather than on finishing, since
+    the caller acts on tokens as they arrive; once a stream is producing,
+    the rest of the completion comes at the same rate either way.
+    """
+    policy = policy or get_hedge_policy()
+    policy.start()
+    started = time.monotonic()
+    messages = queue.Queue()
+    streams = {}
+    closed = threading.Event()
+
+    def pump(index):
+        try:
+            stream = open_stream()
+            streams[index] = stream
+            if closed.is_set():
+                stream.close()
+                return
+            for chunk in stream:
+                messages.put((index, "chunk", chunk))
+            messages.put((index, "end", None))
+        except Exception as e:
+            messages.put((index, "error", e))
+
+    def launch(index):
+        threading.Thread(target=pump, args=(index,), daemon=True).start()
+
+    launch(0)
+    launched, failed = 1, 0
+    buffered = {0: [], 1: []}
+    winner = None
+    delay = policy.delay(name)
+    while winner is None:
+        timeout = None
+        if launched == 1 and delay is not None:
+            timeout = max(0, started + delay - time.monotonic())
+        try:
+            index, kind, payload = messages.get(timeout=timeout)
+        except queue.Empty:
+            if policy.allow_hedge():
+                launch(1)
+                launched = 2
+            delay = None
+            continue
+        if kind == "error":
+            failed += 1
+            if failed == launched:
+                policy.finish(name, time.monotonic() - started, launched > 1, False)
+                raise payload
+            continue
+        if kind == "chunk":
+            buffered[index].append(payload)
+        if kind == "end" or is_first_token(payload):
+            winner = index
+
+    policy.finish(name, time.monotonic() - started, launched > 1, winner == 1)
+    # Close the loser (or have it close itself if it hasn't connected yet)
+    closed.set()
+    for index, stream in list(streams.items()):
+        if index != winner:
+            stream.close()
+
+    yield from buffered[winner]
+    if kind == "end":
+        return
+    while True:
+        index, kind, payload = messages.get()
+        if index != winner:
+            continue
+        if kind == "chunk":
+            yield payload
+        elif kind == "error":
+            raise payload
+        else:
+            return
+
+
+_policy = None
+_policy_lock = threading.Lock()
+
+
+def get_hedge_policy():
+    """Process-wide policy, configured from LLM_HEDGE / LLM_HEDGE_PERCENTILE / LLM_HEDGE_MAX_RATE."""
+    global _policy
+    with _policy_lock:
+        if _policy is None:
+            _policy = HedgePolicy()
+        return _policy
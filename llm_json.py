@@ -0,0 +1,295 @@
+"""
+Incremental parsing for streamed LLM JSON.
+
+A streamed completion arrives a few characters at a time. Rather than wait
+for the closing brace, StreamingJSONParser tracks where it is in the
+document as text is fed in and hands back each object at a watched path as
+soon as that object's closing brace arrives, e.g. every stop of every day
+while the rest of the itinerary is still being written.
+"""
+
+import json
+import threading
+
+# Paths are tuples of object keys and array positions; "*" matches any one step
+ITINERARY_STOP_PATH = ("detailed_itinerary", "*", "stops", "*")
+
+
+def strip_code_fences(content):
+    """Drop the ```json ... ``` wrapper models sometimes put around JSON."""
+    content = content.strip()
+    if content.startswith("```json"):
+        content = content[7:]
+    if content.startswith("```"):
+        content = content[3:]
+    if content.endswith("```"):
+        content = content[:-3]
+    return content.strip()
+
+
+def _matches(path, pattern):
+    return len(path) == len(pattern) and all(p == "*" or p == step for step, p in zip(path, pattern))
+
+
+class _Frame:
+    """One open object or array."""
+
+    __slots__ = ("is_object", "start", "path", "key", "index", "expect_key", "scalar_start", "values")
+
+    def __init__(self, is_object, start, path):
+        self.is_object = is_object
+        self.start = start
+        self.path = path
+        self.key = None
+        self.index = 0
+        self.expect_key = is_object
+        self.scalar_start = None
+        self.values = {}  # Scalar members of an object, e.g. a day's "day" number
+
+    def child_path(self):
+        return self.path + ((self.key if self.is_object else self.index),)
+
+
+class StreamingJSONParser:
+    """Feed text chunks; get back the objects at pattern as they complete.
+
+    feed() returns a list of (path, value, parents) tuples, where parents
+    holds the scalar members already seen on each enclosing object (so a
+    stop arrives with its day's {"day": 2}). Text before the first "{" or
+    "[" and after the document closes, such as markdown fences, is ignored.
+    """
+
+    def __init__(self, pattern=ITINERARY_STOP_PATH):
+        self.pattern = tuple(pattern)
+        self.text = ""
+        self._pos = 0
+        self._stack = []
+        self._in_string = False
+        self._escaped = False
+        self._string_start = None
+        self._done = False
+
+    def feed(self, chunk):
+        self.text += chunk
+        completed = []
+        text = self.text
+        while self._pos < len(text) and not self._done:
+            char = text[self._pos]
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == "\\":
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+                    self._end_string()
+            else:
+                self._structural(char, completed)
+            self._pos += 1
+        return completed
+
+    def _end_string(self):
+        frame = self._stack[-1]
+        value = json.loads(self.text[self._string_start:self._pos + 1])
+        if frame.is_object and frame.expect_key:
+            frame.key = value
+            frame.expect_key = False
+        elif frame.is_object:
+            frame.values[frame.key] = value
+
+    def _end_scalar(self, frame):
+        if frame.scalar_start is None:
+            return
+        raw = self.text[frame.scalar_start:self._pos].strip()
+        frame.scalar_start = None
+        if frame.is_object:
+            try:
+                frame.values[frame.key] = json.loads(raw)
+            except ValueError:
+                pass  # Malformed literal; the final json.loads will report it
+
+    def _structural(self, char, completed):
+        frame = self._stack[-1] if self._stack else None
+        if char in "{[":
+            path = frame.child_path() if frame else ()
+            self._stack.append(_Frame(char == "{", self._pos, path))
+        elif frame is None:
+            return  # Outside the document
+        elif char == '"':
+            self._in_string = True
+            self._string_start = self._pos
+        elif char in "}]":
+            self._end_scalar(frame)
+            self._stack.pop()
+            if not self._stack:
+                self._done = True
+            if _matches(frame.path, self.pattern):
+                value = json.loads(self.text[frame.start:self._pos + 1])
+                parents = tuple(dict(f.values) for f in self._stack if f.is_object)
+                completed.append((frame.path, value, parents))
+        elif char == ",":
+            self._end_scalar(frame)
+            if frame.is_object:
+                frame.expect_key = True
+            else:
+                frame.index += 1
+        elif char == ":" or char.isspace():
+            return
+        elif frame.scalar_start is None and not (frame.is_object and frame.expect_key):
+            frame.scalar_start = self._pos
+
+
+# ---------------- REPAIR ---------------- #
+
+# Fields create_pdf reads from every stop
+STOP_FIELDS = ("time_of_day", "title", "description", "best_time", "logistics", "food_options", "search_query")
+MIN_STOPS_PER_DAY = 2
+
+_repair_stats = {"responses": 0, "repaired": 0, "unrepairable": 0, "days_rerequested": 0, "retries_avoided": 0}
+_repair_stats_lock = threading.Lock()
+
+
+def record_repair(name, count=1):
+    with _repair_stats_lock:
+        _repair_stats[name] += count
+
+
+def repair_stats():
+    """Counters since process start; repaired / responses is the repair rate."""
+    with _repair_stats_lock:
+        return dict(_repair_stats)
+
+
+class GenerationTrace:
+    """What one itinerary request needed: model tier, repairs made and completion tokens used.
+
+    Shared by every call that makes up the request, including the per-day
+    calls running on worker threads. tokens_saved counts the completion
+    tokens cached fragments spared it (see llm_fragments).
+    """
+
+    def __init__(self):
+        self.tier = None  # model_router.Tier currently generating
+        self.repairs = []
+        self.calls = 0
+        self.completion_tokens = 0
+        self.tokens_saved = 0
+        self._lock = threading.Lock()
+
+    def add_call(self, completion_tokens):
+        with self._lock:
+            self.calls += 1
+            self.completion_tokens += completion_tokens or 0
+
+
+def _salvage(text):
+    """Cut text back to the last complete container, drop trailing commas and close what is open."""
+    out = []
+    stack = []
+    cut = None
+    in_string = escaped = False
+    last_significant = None
+    for char in text:
+        if in_string:
+            out.append(char)
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+            continue
+        if char in "}]":
+            if not stack:
+                break
+            if last_significant is not None and out[last_significant] == ",":
+                del out[last_significant]
+            stack.pop()
+            out.append(char)
+            last_significant = len(out) - 1
+            cut = (len(out), list(stack))
+            if not stack:
+                break
+            continue
+        if char == '"':
+            in_string = True
+        elif char in "{[":
+            stack.append("}" if char == "{" else "]")
+        elif not stack and not out:
+            continue  # Chatter before the document
+        out.append(char)
+        if not char.isspace():
+            last_significant = len(out) - 1
+    if cut is None:
+        raise ValueError("no complete JSON container to salvage")
+    length, still_open = cut
+    kept = "".join(out[:length]).rstrip()
+    if kept.endswith(","):
+        kept = kept[:-1]
+    return kept + "".join(reversed(still_open))
+
+
+def repair_json(content, repairs=None):
+    """json.loads that survives truncation and stray trailing commas.
+
+    A response cut off at max_tokens is trimmed back to the last object or
+    array that did close, which drops a half-written trailing stop, and the
+    brackets still open at that point are closed. Raises the original
+    JSONDecodeError if nothing can be salvaged. Pass a list as repairs to
+    have the salvaged text appended to it when a repair was needed.
+    """
+    record_repair("responses")
+    text = strip_code_fences(content)
+    try:
+        return json.loads(text)
+    except json.JSONDecodeError as error:
+        try:
+            value = json.loads(_salvage(text))
+        except ValueError:
+            record_repair("unrepairable")
+            raise error
+        record_repair("repaired")
+        if repairs is not None:
+            repairs.append(text)
+        return value
+
+
+def valid_stop(stop):
+    """Whether stop has every field create_pdf reads, food options included."""
+    if not isinstance(stop, dict) or any(not stop.get(field) for field in STOP_FIELDS):
+        return False
+    food = stop["food_options"]
+    return all(isinstance(food.get(kind), dict) and food[kind].get("name") and food[kind].get("dish")
+               for kind in ("veg", "non_veg"))
+
+
+def validate_itinerary(itinerary, days, min_stops=MIN_STOPS_PER_DAY):
+    """Check a (possibly repaired) itinerary against the schema, in place.
+
+    Incomplete stops are dropped, and so are days left with fewer than
+    min_stops of them. Returns the day numbers that still need generating.
+    Raises ValueError when trip_summary or daily_overview is unusable, since
+    nothing short of a full regeneration can replace those.
+    """
+    summary = itinerary.get("trip_summary") if isinstance(itinerary, dict) else None
+    if not isinstance(summary, dict) or not summary.get("title") or not summary.get("overview"):
+        raise ValueError("itinerary has no usable trip_summary")
+    overview = itinerary.get("daily_overview")
+    if not isinstance(overview, list) or not overview:
+        raise ValueError("itinerary has no usable daily_overview")
+    # Entries without a usable day number would be rendered as "Day None"
+    itinerary["daily_overview"] = [entry for entry in overview
+                                   if isinstance(entry, dict) and isinstance(entry.get("day"), int)
+                                   and 1 <= entry["day"] <= days and entry.get("theme")]
+    if not itinerary["daily_overview"]:
+        raise ValueError("itinerary has no usable daily_overview")
+
+    complete = {}
+    for day_data in itinerary.get("detailed_itinerary") or []:
+        if not isinstance(day_data, dict) or not isinstance(day_data.get("day"), int):
+            continue
+        stops = [stop for stop in day_data.get("stops") or [] if valid_stop(stop)]
+        if len(stops) >= min_stops and 1 <= day_data["day"] <= days:
+            complete.setdefault(day_data["day"], dict(day_data, stops=stops))
+    itinerary["detailed_itinerary"] = [complete[day] for day in sorted(complete)]
+    return [day for day in range(1, days + 1) if day not in complete]
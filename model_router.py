@@ -0,0 +1,109 @@
+"""
+Model tiers for itinerary generation.
+
+Not every trip needs the slowest model: a 2-day weekend on a standard
+budget is fine on a small, fast model, while a 12-day luxury trip is where
+the large one earns its latency. ModelRouter picks a tier from trip size
+and budget, steps down when a tier is currently slow, and gives the
+other tiers as fallbacks for when a call times out or returns something
+that fails validation. Every attempt is recorded with its tier, latency
+and outcome so the table can be tuned.
+"""
+
+import os
+import threading
+from collections import deque, namedtuple
+
+from canonical import canonical_text
+
+Tier = namedtuple("Tier", "name model timeout")
+
+TIERS = (
+    Tier("fast", os.getenv("MODEL_TIER_FAST", "gpt-4o-mini"), 60),
+    Tier("standard", os.getenv("MODEL_TIER_STANDARD", "gpt-4o"), 90),
+    Tier("premium", os.getenv("MODEL_TIER_PREMIUM", "gpt-4"), 120),
+)
+
+# A tier whose recent average latency is above this is skipped for a faster one
+TIER_LATENCY_LIMIT_SECONDS = float(os.getenv("MODEL_TIER_LATENCY_LIMIT_SECONDS", 60))
+LATENCY_SMOOTHING = 0.3
+SKIPPED_TIER_DECAY = 0.9
+MAX_LOG_ENTRIES = 200
+
+# app.py's budget choices, in canonical form
+_NAMED_BUDGET_LEVELS = {"standard": 0, "high end": 1, "luxury": 2}
+
+
+def size_level(days):
+    return 0 if days <= 3 else 1 if days <= 7 else 2
+
+
+def budget_level(budget):
+    """0-2 for a USD amount or one of app.py's named budgets."""
+    if isinstance(budget, str):
+        return _NAMED_BUDGET_LEVELS.get(canonical_text(budget), 1)
+    return 0 if budget < 3000 else 1 if budget < 12000 else 2
+
+
+class ModelRouter:
+    def __init__(self, tiers=TIERS, latency_limit=TIER_LATENCY_LIMIT_SECONDS):
+        self.tiers = tiers
+        self.latency_limit = latency_limit
+        self._latency = {}  # Tier name -> smoothed latency of recent attempts
+        self._log = deque(maxlen=MAX_LOG_ENTRIES)
+        self._lock = threading.Lock()
+
+    def route(self, days, budget):
+        """Tiers to try, in order: the routed tier first, then the rest as fallbacks.
+
+        Trip size and budget level (0-2 each) add up to a 0-4 score; 0-1 is
+        the first tier, 2-3 the second and 4 the third. Fallbacks go to the
+        next faster tier first, then to slower ones.
+        """
+        score = size_level(days) + budget_level(budget)
+        index = min(len(self.tiers) - 1, score // 2)
+        with self._lock:
+            while index > 0 and self._latency.get(self.tiers[index].name, 0) > self.latency_limit:
+                # Skipped tiers get no new samples, so let their latency decay
+                # until they are tried again
+                self._latency[self.tiers[index].name] *= SKIPPED_TIER_DECAY
+                index -= 1
+        order = [index] + list(range(index - 1, -1, -1)) + list(range(index + 1, len(self.tiers)))
+        return [self.tiers[i] for i in order]
+
+    def record(self, tier, latency, outcome, request=None):
+        """Log one attempt (see stats()); outcome is "ok" or the reason it fell back."""
+        with self._lock:
+            previous = self._latency.get(tier.name, latency)
+            self._latency[tier.name] = previous + LATENCY_SMOOTHING * (latency - previous)
+            self._log.append({"tier": tier.name, "model": tier.model, "latency": latency,
+                              "outcome": outcome, "request": request})
+
+    def stats(self):
+        """Per tier: attempts, successes and smoothed latency."""
+        with self._lock:
+            log = list(self._log)
+            latency = dict(self._latency)
+        stats = {}
+        for tier in self.tiers:
+            attempts = [entry for entry in log if entry["tier"] == tier.name]
+            stats[tier.name] = {
+                "model": tier.model,
+                "attempts": len(attempts),
+                "ok": sum(entry["outcome"] == "ok" for entry in attempts),
+                "latency": latency.get(tier.name),
+            }
+        return stats
+
+
+_router = None
+_router_lock = threading.Lock()
+
+
+def get_model_router():
+    """Process-wide router, so latency observed by one session steers the next."""
+    global _router
+    with _router_lock:
+        if _router is None:
+            _router = ModelRouter()
+        return _router
@@ -0,0 +1,62 @@
+import pytest
+
+from canonical import budget_tier, canonical_city, canonical_itinerary_request, canonical_query, strip_time_of_day
+
+
+@pytest.mark.parametrize("name", ["Paris", "paris", " PARIS ", "Paris, France", "paris,  france"])
+def test_city_spellings_share_a_key(name):
+    assert canonical_city(name) == "paris"
+
+
+@pytest.mark.parametrize("alias, city", [("NYC", "new york"), ("New York City", "new york"),
+                                         ("Bombay", "mumbai"), ("München", "munich"), ("Roma, Italy", "rome")])
+def test_city_aliases(alias, city):
+    assert canonical_city(alias) == city
+
+
+def test_different_cities_stay_apart():
+    assert canonical_city("Paris") != canonical_city("Prague")
+
+
+@pytest.mark.parametrize("a, b", [("Paris, France", "Paris, Texas"), ("Portland, Oregon", "Portland, Maine"),
+                                  ("Rome", "Rome, Georgia")])
+def test_qualifiers_that_name_another_place_are_kept(a, b):
+    assert canonical_city(a) != canonical_city(b)
+
+
+@pytest.mark.parametrize("name", ["New York, NY, USA", "NYC, United States", "new york, new york"])
+def test_home_region_and_country_aliases_are_dropped(name):
+    assert canonical_city(name) == "new york"
+
+
+@pytest.mark.parametrize("name", ["Louvre - Morning", "Morning: Louvre", "Louvre (Evening)", "Louvre | late afternoon"])
+def test_time_of_day_is_stripped(name):
+    assert strip_time_of_day(name) == "Louvre"
+
+
+def test_name_that_is_only_a_time_of_day_is_kept():
+    assert strip_time_of_day("Dinner") == "Dinner"
+
+
+def test_query_variants_share_a_key():
+    assert canonical_query("Louvre Museum - Morning") == canonical_query("louvre museum")
+
+
+def test_budgets_in_one_tier_share_a_key():
+    assert budget_tier(5000) == budget_tier(5500) == "under-6000"
+    assert budget_tier(6000) != budget_tier(5999)
+    assert budget_tier(100000) == "over-50000"
+    assert budget_tier("High-End") == budget_tier("high end")
+
+
+def test_equivalent_requests_share_a_key():
+    a = canonical_itinerary_request("NYC", "Paris, France", 5, 5000, 2, "Cultural Immersion")
+    b = canonical_itinerary_request("new york", " paris ", "5", 5500, "2", "cultural immersion")
+    assert a == b
+
+
+def test_meaningful_differences_change_the_key():
+    base = canonical_itinerary_request("NYC", "Paris", 5, 5000, 2, "Foodie Paradise")
+    assert canonical_itinerary_request("NYC", "Paris", 6, 5000, 2, "Foodie Paradise") != base
+    assert canonical_itinerary_request("NYC", "Paris", 5, 15000, 2, "Foodie Paradise") != base
+    assert canonical_itinerary_request("NYC", "Rome", 5, 5000, 2, "Foodie Paradise") != base
@@ -0,0 +1,90 @@
+import os
+import time
+
+import pytest
+
+import image_cache
+from image_cache import ImageCache
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return ImageCache(root=str(tmp_path), max_bytes=10 ** 9)
+
+
+def _age(path, seconds):
+    then = time.time() - seconds
+    os.utime(path, (then, then))
+
+
+def _entries(cache):
+    return sorted(os.listdir(cache.entries_dir))
+
+
+def test_sweep_drops_expired_markers_and_keeps_live_ones(cache):
+    cache.mark_failed("query", "expired", -1)
+    cache.mark_failed("query", "live", 60)
+    cache.evict()
+    assert len(_entries(cache)) == 1
+    assert cache.is_failed("query", "live")
+
+
+def test_sweep_drops_url_records_whose_blob_is_gone(cache):
+    kept = cache.store_image("https://img/kept", b"kept")
+    gone = cache.store_image("https://img/gone", b"gone")
+    os.remove(gone)
+    os.remove(os.path.join(cache.root, ".entries.swept"))
+    cache.evict()
+    assert len(_entries(cache)) == 1
+    assert cache.image_path("https://img/kept") == kept
+
+
+def test_sweep_drops_entries_unused_for_the_max_age(cache):
+    cache.store_url("old query", "https://img/old")
+    cache.store_url("new query", "https://img/new")
+    for name in _entries(cache):
+        _age(os.path.join(cache.entries_dir, name), image_cache.ENTRY_MAX_AGE_SECONDS + 60)
+    assert cache.lookup_url("new query")  # A hit marks the entry as used
+    cache.evict()
+    assert cache.lookup_url("old query") is None
+    assert cache.lookup_url("new query") == "https://img/new"
+
+
+def test_sweep_runs_at_most_once_per_interval(cache):
+    cache.evict()
+    cache.mark_failed("url", "https://img/x", -1)
+    cache.evict()
+    assert len(_entries(cache)) == 1
+
+
+def test_eviction_drops_least_recently_used_blobs_first(tmp_path):
+    cache = ImageCache(root=str(tmp_path), max_bytes=25)
+    old = cache.store_image("https://img/old", b"o" * 10)
+    used = cache.store_image("https://img/used", b"u" * 10)
+    _age(old, 120)
+    _age(used, 60)
+    assert cache.image_path("https://img/used") == used  # A hit marks it as recently used
+    cache.store_image("https://img/new", b"n" * 10)
+    assert not os.path.exists(old)
+    assert cache.image_path("https://img/used") == used
+    assert cache.image_path("https://img/new")
+
+
+def test_identical_bytes_are_stored_once(cache):
+    assert cache.store_image("https://img/a", b"same") == cache.store_image("https://img/b", b"same")
+    assert cache.load_image("https://img/b") == b"same"
+
+
+def test_negative_entries_expire(cache, monkeypatch):
+    cache.mark_failed("query", "Louvre - Morning", ttl=60)
+    assert cache.is_failed("query", "louvre")  # Keyed on the canonical query
+    assert not cache.is_failed("url", "louvre")
+    now = time.time()
+    monkeypatch.setattr(image_cache.time, "time", lambda: now + 61)
+    assert not cache.is_failed("query", "louvre")
+
+
+def test_url_lookups_share_canonical_keys(cache):
+    cache.store_url("Louvre - Morning", "https://img/louvre")
+    assert cache.lookup_url("louvre") == "https://img/louvre"
+    assert cache.stats()["url_hits_canonical_only"] == 1
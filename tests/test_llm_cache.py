@@ -0,0 +1,60 @@
+import os
+import time
+
+import pytest
+
+import llm_cache
+from llm_cache import ResponseCache, make_key
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return ResponseCache(root=str(tmp_path), ttl=60, max_entries=3)
+
+
+def _later(monkeypatch, seconds):
+    now = time.time()
+    monkeypatch.setattr(llm_cache.time, "time", lambda: now + seconds)
+
+
+def test_round_trip(cache):
+    cache.put("k", {"trip": 1}, raw=["Paris"])
+    assert cache.get("k") == {"trip": 1}
+    assert cache.get("missing") is None
+    assert cache.stats() == {"hits": 1, "misses": 1, "canonical_only_hits": 0}
+
+
+def test_entries_expire_after_the_ttl(cache, monkeypatch):
+    cache.put("k", "v")
+    _later(monkeypatch, 61)
+    assert cache.get("k") is None
+
+
+def test_a_longer_ttl_can_be_asked_for(cache, monkeypatch):
+    cache.put("k", "v")
+    _later(monkeypatch, 61)
+    assert cache.get("k", ttl=120) == "v"
+
+
+def test_hits_on_a_different_raw_request_are_counted(cache):
+    cache.put("k", "v", raw=["paris"])
+    cache.get("k", raw=["Paris, France"])
+    cache.get("k", raw=["paris"])
+    assert cache.stats()["canonical_only_hits"] == 1
+
+
+def test_oldest_entries_beyond_max_entries_are_evicted(cache):
+    for n in range(3):
+        cache.put(f"k{n}", n)
+        then = time.time() - 100 + n
+        os.utime(cache._path(f"k{n}"), (then, then))
+    cache.put("k3", 3)
+    assert cache.get("k0") is None
+    assert [cache.get(f"k{n}") for n in (1, 2, 3)] == [1, 2, 3]
+
+
+def test_keys_ignore_dict_order_but_not_the_fingerprint():
+    a = make_key({"days": 3, "destination": "paris"}, template="T1", model="gpt-4")
+    assert a == make_key({"destination": "paris", "days": 3}, model="gpt-4", template="T1")
+    assert a != make_key({"days": 3, "destination": "paris"}, template="T2", model="gpt-4")
+    assert a != make_key({"days": 4, "destination": "paris"}, template="T1", model="gpt-4")
@@ -0,0 +1,113 @@
+import itertools
+import threading
+import time
+
+import pytest
+
+from llm_hedge import HedgePolicy, LatencyTracker, hedged_call, hedged_stream
+
+
+def _policy(enabled=True, max_rate=1.0, latency=0.01):
+    tracker = LatencyTracker()
+    for _ in range(20):
+        tracker.record("call", latency)
+    return HedgePolicy(enabled=enabled, percentile=90, max_rate=max_rate, tracker=tracker)
+
+
+def _calls(*behaviours):
+    """A call() whose nth invocation runs behaviours[n]."""
+    counter = itertools.count()
+    return lambda: behaviours[next(counter)]()
+
+
+def _after(seconds, value=None, error=None):
+    def run():
+        time.sleep(seconds)
+        if error:
+            raise error
+        return value
+    return run
+
+
+def test_percentile_needs_enough_samples():
+    tracker = LatencyTracker()
+    for n in range(19):
+        tracker.record("call", n)
+    assert tracker.percentile("call", 90) is None
+    tracker.record("call", 19)
+    assert tracker.percentile("call", 90) == 18
+    assert tracker.percentile("other", 90) is None
+
+
+def test_no_hedge_while_disabled():
+    policy = _policy(enabled=False)
+    assert hedged_call("call", _calls(_after(0.05, "first")), policy) == "first"
+    assert policy.stats()["hedged"] == 0
+
+
+def test_a_slow_call_is_hedged_and_the_faster_answer_wins():
+    release = threading.Event()
+    policy = _policy()
+    result = hedged_call("call", _calls(lambda: release.wait(5) and "first", _after(0, "hedge")), policy)
+    release.set()
+    assert result == "hedge"
+    assert policy.stats() == {"requests": 1, "hedged": 1, "hedge_wins": 1, "capped": 0}
+
+
+def test_hedges_are_capped_by_max_rate():
+    policy = _policy(max_rate=0)
+    assert hedged_call("call", _calls(_after(0.05, "first")), policy) == "first"
+    assert policy.stats()["capped"] == 1
+    assert policy.stats()["hedged"] == 0
+
+
+def test_a_failed_call_waits_for_the_other():
+    policy = _policy()
+    calls = _calls(_after(0.05, error=RuntimeError("boom")), _after(0.1, "hedge"))
+    assert hedged_call("call", calls, policy) == "hedge"
+
+
+def test_raises_when_every_call_fails():
+    policy = _policy()
+    calls = _calls(_after(0.05, error=RuntimeError("first")), _after(0.1, error=RuntimeError("hedge")))
+    with pytest.raises(RuntimeError):
+        hedged_call("call", calls, policy)
+
+
+class _Stream:
+    def __init__(self, chunks, delay=0.0):
+        self.chunks = chunks
+        self.delay = delay
+        self.closed = False
+
+    def __iter__(self):
+        time.sleep(self.delay)
+        for chunk in self.chunks:
+            if self.closed:
+                return
+            yield chunk
+
+    def close(self):
+        self.closed = True
+
+
+def test_stream_with_a_slow_first_token_is_hedged():
+    slow, fast = _Stream(["a", "b"], delay=0.5), _Stream(["x", "y", "z"])
+    policy = _policy()
+    chunks = list(hedged_stream("call", _calls(lambda: slow, lambda: fast), lambda chunk: True, policy))
+    assert chunks == ["x", "y", "z"]
+    assert slow.closed
+    assert policy.stats()["hedge_wins"] == 1
+
+
+def test_stream_without_hedging_passes_chunks_through():
+    policy = _policy(enabled=False)
+    stream = _Stream(["", "a", "b"])
+    assert list(hedged_stream("call", lambda: stream, bool, policy)) == ["", "a", "b"]
+
+
+def test_stream_errors_are_raised():
+    def broken():
+        raise RuntimeError("no stream")
+    with pytest.raises(RuntimeError):
+        list(hedged_stream("call", broken, bool, _policy(enabled=False)))
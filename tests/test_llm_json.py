@@ -0,0 +1,162 @@
+import json
+
+import pytest
+
+from llm_json import StreamingJSONParser, _salvage, repair_json, validate_itinerary
+
+
+def _stop(title):
+    return {
+        "time_of_day": "Morning", "title": title, "description": "d", "best_time": "09:00 AM",
+        "logistics": "Metro", "search_query": f"{title} Paris",
+        "food_options": {"veg": {"name": "V", "dish": "v"}, "non_veg": {"name": "N", "dish": "n"}},
+    }
+
+
+def _itinerary(days=2, stops=2):
+    return {
+        "trip_summary": {"title": "Trip", "overview": "Nice"},
+        "daily_overview": [{"day": day, "theme": f"Theme {day}"} for day in range(1, days + 1)],
+        "detailed_itinerary": [{"day": day, "stops": [_stop(f"Stop {day}.{n}") for n in range(stops)]}
+                               for day in range(1, days + 1)],
+    }
+
+
+def _feed(parser, text, size):
+    completed = []
+    for start in range(0, len(text), size):
+        completed += parser.feed(text[start:start + size])
+    return completed
+
+
+# ---------------- STREAMING PARSER ---------------- #
+
+@pytest.mark.parametrize("size", [1, 2, 7, 64, 100000])
+def test_stops_arrive_whatever_the_chunking(size):
+    itinerary = _itinerary()
+    completed = _feed(StreamingJSONParser(), json.dumps(itinerary, indent=2), size)
+    assert [value for _, value, _ in completed] == [stop for day in itinerary["detailed_itinerary"]
+                                                    for stop in day["stops"]]
+    assert [path for path, _, _ in completed] == [("detailed_itinerary", d, "stops", s)
+                                                  for d in range(2) for s in range(2)]
+
+
+def test_stop_arrives_as_soon_as_it_closes():
+    text = json.dumps(_itinerary())
+    first_close = text.index("}}}") + 3  # End of the first stop's food_options and the stop itself
+    parser = StreamingJSONParser()
+    assert parser.feed(text[:first_close - 1]) == []
+    (path, value, parents), = parser.feed(text[first_close - 1:first_close])
+    assert value["title"] == "Stop 1.0"
+
+
+def test_parents_carry_the_enclosing_day():
+    completed = StreamingJSONParser().feed(json.dumps(_itinerary()))
+    assert [parents[-1]["day"] for _, _, parents in completed] == [1, 1, 2, 2]
+
+
+def test_braces_and_quotes_inside_strings_are_ignored():
+    itinerary = _itinerary(days=1)
+    itinerary["detailed_itinerary"][0]["stops"][0]["description"] = 'A "quoted" {brace} [and] \\ backslash'
+    completed = _feed(StreamingJSONParser(), json.dumps(itinerary), 3)
+    assert completed[0][1]["description"] == 'A "quoted" {brace} [and] \\ backslash'
+
+
+def test_text_around_the_document_is_ignored():
+    parser = StreamingJSONParser()
+    completed = _feed(parser, "```json\n" + json.dumps(_itinerary(days=1)) + "\n```", 5)
+    assert len(completed) == 2
+    assert parser.text.startswith("```json")
+
+
+def test_custom_pattern():
+    parser = StreamingJSONParser(("d", "*", "s", "*"))
+    completed = parser.feed('{"d":[{"n":1,"s":[{"p":"A"},{"p":"B"}]}]}')
+    assert [value["p"] for _, value, _ in completed] == ["A", "B"]
+    assert completed[0][2][-1] == {"n": 1}
+
+
+# ---------------- REPAIR ---------------- #
+
+def test_valid_json_is_untouched():
+    repairs = []
+    assert repair_json(json.dumps({"a": [1, 2]}), repairs) == {"a": [1, 2]}
+    assert repairs == []
+
+
+def test_code_fences_are_stripped():
+    assert repair_json('```json\n{"a": 1}\n```') == {"a": 1}
+
+
+def test_trailing_commas_are_dropped():
+    repairs = []
+    assert repair_json('{"a": [1, 2, ], "b": {"c": 3,},}', repairs) == {"a": [1, 2], "b": {"c": 3}}
+    assert len(repairs) == 1
+
+
+@pytest.mark.parametrize("cut", [0.3, 0.5, 0.77, 0.9, 0.99])
+def test_truncated_itinerary_keeps_every_complete_stop(cut):
+    itinerary = _itinerary(days=3)
+    text = json.dumps(itinerary)
+    truncated = text[:int(len(text) * cut)]
+    value = repair_json(truncated)
+    salvaged = [stop for day in value.get("detailed_itinerary", []) for stop in day["stops"]]
+    written = [stop for day in itinerary["detailed_itinerary"] for stop in day["stops"]
+               if json.dumps(stop) in truncated]
+    # Every stop that was fully written survives intact; a half-written one
+    # may come back partial, and validation then drops it
+    assert salvaged[:len(written)] == written
+    assert len(salvaged) - len(written) <= 1
+
+
+def test_truncated_mid_stop_drops_that_stop():
+    text = json.dumps(_itinerary(days=1))
+    cut = text.index('"Stop 1.1"') + 4
+    value = repair_json(text[:cut])
+    assert [stop["title"] for stop in value["detailed_itinerary"][0]["stops"]] == ["Stop 1.0"]
+    assert value["trip_summary"] == {"title": "Trip", "overview": "Nice"}
+
+
+def test_truncated_inside_a_string():
+    assert json.loads(_salvage('{"a": [1, 2], "b": "unfinish')) == {"a": [1, 2]}
+
+
+def test_nothing_to_salvage_raises_the_original_error():
+    with pytest.raises(json.JSONDecodeError):
+        repair_json('{"a": "no closing')
+    with pytest.raises(ValueError):
+        _salvage("no json here")
+
+
+# ---------------- VALIDATION ---------------- #
+
+def test_complete_itinerary_has_no_missing_days():
+    assert validate_itinerary(_itinerary(days=3), 3) == []
+
+
+def test_incomplete_stops_and_thin_days_are_requested_again():
+    itinerary = _itinerary(days=3)
+    del itinerary["detailed_itinerary"][1]["stops"][0]["logistics"]
+    itinerary["detailed_itinerary"].pop()
+    assert validate_itinerary(itinerary, 3) == [2, 3]
+    assert [day["day"] for day in itinerary["detailed_itinerary"]] == [1]
+
+
+def test_overview_entries_without_a_day_are_dropped():
+    itinerary = _itinerary(days=2)
+    itinerary["daily_overview"].append({"day": None, "theme": "Ghost"})
+    itinerary["daily_overview"].append({"theme": "No day"})
+    validate_itinerary(itinerary, 2)
+    assert [entry["day"] for entry in itinerary["daily_overview"]] == [1, 2]
+
+
+@pytest.mark.parametrize("broken", [
+    {"trip_summary": None},
+    {"trip_summary": {"title": "Only a title"}},
+    {"daily_overview": []},
+    {"daily_overview": [{"day": None, "theme": "x"}]},
+])
+def test_unusable_summary_or_overview_raises(broken):
+    itinerary = dict(_itinerary(), **broken)
+    with pytest.raises(ValueError):
+        validate_itinerary(itinerary, 2)
@@ -0,0 +1,49 @@
+import pytest
+
+from model_router import TIERS, ModelRouter, budget_level
+
+
+def _names(tiers):
+    return [tier.name for tier in tiers]
+
+
+@pytest.mark.parametrize("days, budget, order", [
+    (2, "Standard", ["fast", "standard", "premium"]),
+    (2, 500, ["fast", "standard", "premium"]),
+    (5, "High-End", ["standard", "fast", "premium"]),
+    (12, 2000, ["standard", "fast", "premium"]),
+    (12, "Luxury", ["premium", "standard", "fast"]),
+])
+def test_route_picks_a_tier_then_falls_back_faster_first(days, budget, order):
+    assert _names(ModelRouter().route(days, budget)) == order
+
+
+def test_named_and_numeric_budgets():
+    assert budget_level("luxury") == budget_level(20000) == 2
+    assert budget_level("Standard") == budget_level(1000) == 0
+    assert budget_level("something else") == 1
+
+
+def test_a_slow_tier_is_skipped_for_a_faster_one():
+    router = ModelRouter(latency_limit=60)
+    router.record(TIERS[2], 100, "ok")
+    assert _names(router.route(12, "Luxury")) == ["standard", "fast", "premium"]
+
+
+def test_a_skipped_tier_is_tried_again_once_its_latency_decays():
+    router = ModelRouter(latency_limit=60)
+    router.record(TIERS[2], 70, "ok")
+    routes = [router.route(12, "Luxury")[0].name for _ in range(5)]
+    assert routes[0] == "standard"
+    assert routes[-1] == "premium"
+
+
+def test_stats_count_attempts_per_tier():
+    router = ModelRouter()
+    router.record(TIERS[0], 10, "ok")
+    router.record(TIERS[0], 20, "timeout")
+    stats = router.stats()
+    assert stats["fast"]["attempts"] == 2
+    assert stats["fast"]["ok"] == 1
+    assert stats["fast"]["latency"] == pytest.approx(13)
+    assert stats["premium"]["attempts"] == 0
@@ -0,0 +1,71 @@
+import json
+import math
+
+import pytest
+
+from token_budget import DEFAULT_AVERAGES, TokenPlanner, output_limit
+
+
+@pytest.fixture
+def planner(tmp_path):
+    return TokenPlanner(str(tmp_path / "token_stats.json"))
+
+
+def _stop(chars=50):
+    return {"title": "t" * chars, "description": "d" * chars}
+
+
+def test_estimate_grows_with_days_and_stops(planner):
+    assert planner.estimate(2) < planner.estimate(4) < planner.estimate(4, stops_per_day=5)
+
+
+def test_estimate_parts_add_up(planner):
+    whole = planner.estimate(3)
+    parts = planner.estimate(3, details=False) + planner.estimate(3, summary=False)
+    assert abs(whole - parts) <= 1
+
+
+def test_max_tokens_adds_headroom_and_is_capped(planner):
+    assert planner.max_tokens(1000, "gpt-4") == math.ceil(1000 * planner.headroom)
+    assert planner.max_tokens(10 ** 6, "gpt-4") == output_limit("gpt-4")
+    assert planner.fits(1000, "gpt-4")
+    assert not planner.fits(output_limit("gpt-4"), "gpt-4")
+
+
+def test_record_learns_tokens_per_char_and_saves(planner, tmp_path):
+    before = planner.averages["tokens_per_char"]
+    planner.record("full", 100, "x" * 100, 50)
+    assert planner.averages["tokens_per_char"] > before
+    saved = json.loads((tmp_path / "token_stats.json").read_text())
+    assert saved["averages"]["tokens_per_char"] == planner.averages["tokens_per_char"]
+    assert TokenPlanner(str(tmp_path / "token_stats.json")).averages == planner.averages
+
+
+def test_longer_stops_raise_later_estimates(planner):
+    before = planner.estimate(3)
+    value = {"detailed_itinerary": [{"day": 1, "stops": [_stop(2000)]}]}
+    planner.record("day", before, json.dumps(value), None, value)
+    assert planner.estimate(3) > before
+
+
+def test_sections_a_completion_lacks_are_not_learned(planner):
+    value = {"detailed_itinerary": [{"day": 1, "stops": [_stop()]}]}
+    planner.record("extension", 100, json.dumps(value), None, value)
+    assert planner.averages["summary"] == DEFAULT_AVERAGES["summary"]
+    assert planner.averages["day_overview"] == DEFAULT_AVERAGES["day_overview"]
+
+
+def test_a_title_only_summary_is_not_learned(planner):
+    # The overview was cached and left out of the prompt, and the estimate already subtracts it
+    value = {"trip_summary": {"title": "Trip"}, "daily_overview": [{"day": 1, "theme": "Museums"}]}
+    planner.record("skeleton", 100, json.dumps(value), None, value)
+    assert planner.averages["summary"] == DEFAULT_AVERAGES["summary"]
+    assert planner.averages["day_overview"] < DEFAULT_AVERAGES["day_overview"]
+
+
+def test_stats_compare_actual_with_estimate(planner):
+    assert planner.stats() == {"samples": 0, "actual_vs_estimate": None}
+    planner.record("full", 100, "x", 120)
+    planner.record("full", 100, "x", 80)
+    planner.record("full", 100, "x", None)
+    assert planner.stats() == {"samples": 2, "actual_vs_estimate": pytest.approx(1.0)}
@@ -0,0 +1,106 @@
+import threading
+
+import pytest
+
+pytest.importorskip("requests")
+pytest.importorskip("openai")
+
+import unsplash
+from unsplash import BATCH_QUERIES, BatchResolver
+
+
+def _photo(id, description):
+    return {"id": id, "description": description, "alt_description": None, "tags": [],
+            "urls": {"raw": f"https://images.unsplash.com/{id}"}}
+
+
+POOL = [
+    _photo("louvre", "The Louvre museum glass pyramid"),
+    _photo("eiffel", "Eiffel Tower at dusk"),
+    _photo("eiffel-2", "Eiffel Tower from the river"),
+    _photo("seine", "Boats on the Seine"),
+]
+
+
+@pytest.fixture
+def searches(monkeypatch):
+    """Queries sent to /search/photos; destination searches return POOL, stop searches one photo each."""
+    made = []
+    lock = threading.Lock()
+
+    def search_photos(access_key, query, per_page=1, page=1, timeout=10):
+        with lock:
+            made.append(query)
+        if per_page > 1:
+            return POOL
+        if "Nowhere" in query:
+            return []
+        return [_photo(f"search-{query}", query)]
+
+    monkeypatch.setattr(unsplash, "search_photos", search_photos)
+    return made
+
+
+def _url(id):
+    return f"https://images.unsplash.com/{id}"
+
+
+STOPS = {
+    "Paris Louvre": "Louvre Museum",
+    "Paris Eiffel": "Eiffel Tower",
+    "Paris Eiffel night": "Eiffel Tower at night",
+    "Paris Catacombs": "Catacombs",
+}
+
+
+def test_small_trips_search_each_stop(searches):
+    resolver = BatchResolver("key", "Paris")
+    stops = dict(list(STOPS.items())[:len(BATCH_QUERIES)])
+    assert resolver.resolve(stops) == {query: _url(f"search-{query}") for query in stops}
+    assert resolver.api_calls == len(stops)
+
+
+def test_stops_are_matched_to_the_pool_once_each(searches):
+    resolver = BatchResolver("key", "Paris")
+    urls = resolver.resolve(STOPS)
+    assert urls["Paris Louvre"] == _url("louvre")
+    assert {urls["Paris Eiffel"], urls["Paris Eiffel night"]} == {_url("eiffel"), _url("eiffel-2")}
+    # Nothing in the pool matches, so it gets its own search
+    assert urls["Paris Catacombs"] == _url("search-Paris Catacombs")
+    assert resolver.api_calls == len(BATCH_QUERIES) + 1
+
+
+def test_empty_searches_are_reported_as_no_results(searches):
+    resolver = BatchResolver("key", "Paris")
+    assert resolver.resolve({"Nowhere": "Nowhere"}) == {"Nowhere": None}
+    assert resolver.no_results == {"Nowhere"}
+
+
+def test_resolve_one_fetches_the_pool_once(searches):
+    resolver = BatchResolver("key", "Paris")
+    for query, text in STOPS.items():
+        resolver.resolve_one(query, text)
+    pool_queries = [template.format(destination="Paris") for template in BATCH_QUERIES]
+    assert sorted(query for query in searches if query in pool_queries) == sorted(pool_queries)
+
+
+def test_resolve_one_never_hands_out_a_photo_twice(searches):
+    resolver = BatchResolver("key", "Paris")
+    first = resolver.resolve_one("Paris Eiffel", "Eiffel Tower")
+    second = resolver.resolve_one("Paris Eiffel 2", "Eiffel Tower")
+    third = resolver.resolve_one("Paris Eiffel 3", "Eiffel Tower")
+    assert [first, second] == [_url("eiffel"), _url("eiffel-2")]
+    assert third == _url("search-Paris Eiffel 3")
+
+
+def test_released_claims_can_be_matched_again(searches):
+    resolver = BatchResolver("key", "Paris")
+    assert resolver.resolve_one("Paris Louvre", "Louvre Museum") == _url("louvre")
+    resolver.release_claims()
+    assert resolver.resolve_one("Paris Louvre again", "Louvre Museum") == _url("louvre")
+
+
+def test_resolve_one_skips_the_pool_for_small_trips(searches):
+    resolver = BatchResolver("key", "Paris", expected_stops=len(BATCH_QUERIES))
+    assert resolver.resolve_one("Paris Louvre", "Louvre Museum") == _url("search-Paris Louvre")
+    assert searches == ["Paris Louvre"]
@@ -0,0 +1,124 @@
+import json
+
+from llm_json import validate_itinerary
+from wire_schema import (expand_day, expand_itinerary, expand_itinerary_text, expand_stop, maps_url,
+                         missing_text_days, parse_compact_text)
+
+COMPACT_STOP = {"w": "M", "p": "Louvre", "x": "Art", "b": "09:00 AM", "l": "Metro line 1",
+                "v": ["Le Potager", "Ratatouille"], "nv": ["Chez Paul", "Steak frites"], "q": "Louvre Paris"}
+
+COMPACT_TEXT = """O: Five days of art and food.
+G: Direct flight from New York to CDG,
+then RER B into the city.
+T: Museums
+T: Montmartre
+D: Museum day
+S: Louvre | M
+B: 09:00 AM
+L: Metro line 1
+X: The world's largest art museum,
+best visited early.
+V: Le Potager (French)
+N: Chez Paul (Bistro)
+S: Musée d'Orsay | A
+X: Impressionists
+D: Montmartre
+S: Sacré-Cœur | E
+X: Sunset views
+TIPS:
+- Carry a reusable bottle
+- Book museums ahead
+"""
+
+
+# ---------------- JSON ---------------- #
+
+def test_stop_round_trip():
+    stop = expand_stop(COMPACT_STOP)
+    assert stop == {
+        "time_of_day": "Morning", "title": "Louvre", "description": "Art", "best_time": "09:00 AM",
+        "logistics": "Metro line 1", "search_query": "Louvre Paris",
+        "food_options": {"veg": {"name": "Le Potager", "dish": "Ratatouille"},
+                         "non_veg": {"name": "Chez Paul", "dish": "Steak frites"}},
+    }
+
+
+def test_unknown_time_code_passes_through():
+    assert expand_stop(dict(COMPACT_STOP, w="Late night"))["time_of_day"] == "Late night"
+
+
+def test_missing_keys_stay_missing_for_validation():
+    stop = expand_stop({"p": "Louvre", "v": "not a pair"})
+    assert stop == {"title": "Louvre"}
+
+
+def test_itinerary_round_trip_validates():
+    compact = {"t": "Paris", "o": "Art and food",
+               "d": [{"n": n, "th": f"Theme {n}", "s": [COMPACT_STOP, dict(COMPACT_STOP, w="A", p="Orsay")]}
+                     for n in (1, 2)]}
+    itinerary = expand_itinerary(json.loads(json.dumps(compact, separators=(",", ":"))))
+    assert itinerary["trip_summary"] == {"title": "Paris", "overview": "Art and food"}
+    assert itinerary["daily_overview"] == [{"day": 1, "theme": "Theme 1"}, {"day": 2, "theme": "Theme 2"}]
+    assert validate_itinerary(itinerary, 2) == []
+    assert [stop["title"] for stop in itinerary["detailed_itinerary"][1]["stops"]] == ["Louvre", "Orsay"]
+
+
+def test_skeleton_has_no_detailed_itinerary():
+    itinerary = expand_itinerary({"t": "Paris", "d": [{"n": 1, "th": "Museums"}]})
+    assert "detailed_itinerary" not in itinerary
+    assert itinerary["trip_summary"] == {"title": "Paris"}
+
+
+def test_day_round_trip():
+    assert expand_day({"n": 3, "s": [COMPACT_STOP]}) == {"day": 3, "stops": [expand_stop(COMPACT_STOP)]}
+
+
+def test_maps_url_is_escaped():
+    assert maps_url("Paris Musée d'Orsay") == "https://maps.google.com/?q=Paris+Mus%C3%A9e+d%27Orsay"
+
+
+# ---------------- TEXT ---------------- #
+
+def test_text_sections_are_parsed():
+    parsed = parse_compact_text(COMPACT_TEXT)
+    assert parsed["overview"] == ["Five days of art and food."]
+    assert parsed["getting_there"] == ["Direct flight from New York to CDG,", "then RER B into the city."]
+    assert parsed["timeline"] == ["Museums", "Montmartre"]
+    assert [day["title"] for day in parsed["days"]] == ["Museum day", "Montmartre"]
+    assert parsed["tips"] == ["- Carry a reusable bottle", "- Book museums ahead"]
+
+
+def test_wrapped_field_is_continued():
+    louvre = parse_compact_text(COMPACT_TEXT)["days"][0]["stops"][0]
+    assert louvre["details"] == "The world's largest art museum, best visited early."
+    assert louvre["veg"] == "Le Potager (French)"
+
+
+def test_missing_days_are_reported():
+    assert missing_text_days(COMPACT_TEXT, 2) == []
+    assert missing_text_days(COMPACT_TEXT, 3) == [3]
+    assert missing_text_days(COMPACT_TEXT.replace("S: Sacré-Cœur | E\nX: Sunset views\n", ""), 2) == [2]
+
+
+def test_text_expands_to_the_tagged_format():
+    text = expand_itinerary_text(COMPACT_TEXT, "Paris")
+    lines = text.splitlines()
+    assert lines[0] == "TITLE: Journey to Paris"
+    assert lines.index("TIMELINE_START") < lines.index("Day 1: Museums") < lines.index("TIMELINE_END")
+    assert "STOP: Louvre - Morning" in lines
+    assert "STOP: Musée d'Orsay - Afternoon" in lines
+    assert "- 🥗 Veg: Le Potager (French)" in lines
+    assert any(line.startswith("DETAILS: Sunset views <link href=\"https://maps.google.com/?q=Paris+Sacr")
+               for line in lines)
+    assert lines[-3:] == ["TRAVEL_TIPS:", "- Carry a reusable bottle", "- Book museums ahead"]
+
+
+def test_cached_sections_fill_only_what_is_missing():
+    without = COMPACT_TEXT.split("TIPS:")[0].replace("G: Direct flight from New York to CDG,\nthen RER B into the city.\n", "")
+    text = expand_itinerary_text(without, "Paris", {"getting_there": ["Cached route"], "tips": ["- Cached tip"]})
+    lines = text.splitlines()
+    assert lines[lines.index("GETTING_THERE:") + 1] == "Cached route"
+    assert lines[-1] == "- Cached tip"
+    # A section the model did write wins over the cached one
+    text = expand_itinerary_text(COMPACT_TEXT, "Paris", {"tips": ["- Cached tip"]})
+    assert "- Cached tip" not in text
@@ -0,0 +1,176 @@
+"""
+Output-token budgets for itinerary completions.
+
+A fixed max_tokens is wrong at both ends: a 1-day trip never needs 3000
+tokens, and a 10-day one gets cut off. TokenPlanner estimates the output of
+a request from days x stops x the average size of each stop field, with
+those averages learned from completions we have actually received, and
+says when a trip is too big for one call. Every completion is recorded as
+estimate vs actual so drift is visible in stats().
+"""
+
+import json
+import math
+import os
+import threading
+
+from image_cache import atomic_write
+from llm_cache import DEFAULT_CACHE_DIR
+
+# Largest completion we ask for in one call, per model
+MODEL_OUTPUT_LIMITS = {"gpt-4": 4096, "gpt-4o": 4096, "gpt-4o-mini": 4096}
+DEFAULT_OUTPUT_LIMIT = 4096
+DEFAULT_STOPS_PER_DAY = 3
+HEADROOM = 1.25
+# Weight of the newest completion in the running averages
+LEARNING_RATE = 0.2
+MAX_SAMPLES = 200
+
+# Starting averages, in characters of field content
+DEFAULT_STOP_FIELD_CHARS = {
+    "time_of_day": 7,
+    "title": 28,
+    "description": 200,
+    "best_time": 8,
+    "logistics": 90,
+    "food_options": 70,
+    "search_query": 28,
+}
+DEFAULT_AVERAGES = {
+    "stop_fields": DEFAULT_STOP_FIELD_CHARS,
+    "stop_overhead": 260,    # Keys, quotes, indentation and the day/summary wrappers, per stop
+    "summary": 420,          # trip_summary title + overview
+    "day_overview": 50,      # One daily_overview entry
+    "tokens_per_char": 0.26,
+}
+
+
+class TokenPlanner:
+    def __init__(self, path, headroom=HEADROOM):
+        self.path = path
+        self.headroom = headroom
+        self._lock = threading.Lock()
+        try:
+            with open(path, "rb") as f:
+                state = json.loads(f.read())
+        except (OSError, ValueError):
+            state = {}
+        self.averages = state.get("averages") or json.loads(json.dumps(DEFAULT_AVERAGES))
+        self.samples = state.get("samples") or []
+
+    def estimate(self, days, stops_per_day=DEFAULT_STOPS_PER_DAY, summary=True, details=True):
+        """Expected completion tokens for the summary part, the detailed days, or both."""
+        with self._lock:
+            averages = self.averages
+            chars = 0
+            if summary:
+                chars += averages["summary"] + days * averages["day_overview"]
+            if details:
+                stop_chars = sum(averages["stop_fields"].values()) + averages["stop_overhead"]
+                chars += days * stops_per_day * stop_chars
+            return math.ceil(chars * averages["tokens_per_char"])
+
+    def tokens(self, text):
+        """Expected completion tokens for a piece of generated text."""
+        return math.ceil(len(text) * self.averages["tokens_per_char"])
+
+    def max_tokens(self, estimate, model):
+        """max_tokens to request for an estimate: some headroom, capped at the model's limit."""
+        return min(math.ceil(estimate * self.headroom), output_limit(model))
+
+    def fits(self, estimate, model):
+        return math.ceil(estimate * self.headroom) <= output_limit(model)
+
+    def record(self, kind, estimate, text, completion_tokens, value=None):
+        """Record estimate vs actual for one completion (see stats()) and learn from it.
+
+        text is the raw completion, value its parsed JSON (if any); the
+        averages move towards what this completion actually contained.
+        """
+        actual = completion_tokens
+        with self._lock:
+            self.samples = (self.samples + [{"kind": kind, "estimate": estimate, "actual": actual}])[-MAX_SAMPLES:]
+            if actual and text:
+                self._learn("tokens_per_char", actual / len(text))
+            if isinstance(value, dict):
+                self._learn_from(value, text)
+            state = {"averages": self.averages, "samples": self.samples}
+        try:
+            atomic_write(self.path, json.dumps(state).encode("utf-8"))
+        except OSError:
+            pass  # Learned in memory anyway; the next record() tries to save again
+
+    def _learn(self, name, observed, table=None):
+        table = self.averages if table is None else table
+        table[name] += LEARNING_RATE * (observed - table[name])
+
+    def _learn_from(self, value, text):
+        """Learn field sizes from the parsed value; whatever else the text holds is per-stop overhead.
+
+        Sizes are measured as content characters, so this works whatever key
+        names the model was asked to write.
+        """
+        content = 0
+        # Only sections the completion actually contains are learned from; e.g.
+        # a day extension has no trip_summary, and must not teach it is empty.
+        # A summary without an overview had it left out of the prompt (see
+        # llm_fragments), and the estimate already subtracts the cached
+        # overview, so learning a title-only size would count it twice.
+        summary = value.get("trip_summary")
+        if isinstance(summary, dict) and summary:
+            size = _content_chars(summary.get("title")) + _content_chars(summary.get("overview"))
+            if summary.get("overview"):
+                self._learn("summary", size)
+            content += size
+        for entry in value.get("daily_overview") or []:
+            if isinstance(entry, dict) and entry.get("theme"):
+                size = _content_chars(entry.get("theme")) + 8
+                self._learn("day_overview", size)
+                content += size
+        stops = [stop for day in value.get("detailed_itinerary") or [value] if isinstance(day, dict)
+                 for stop in day.get("stops") or [] if isinstance(stop, dict)]
+        for stop in stops:
+            for field in self.averages["stop_fields"]:
+                if field in stop:
+                    size = _content_chars(stop[field])
+                    self._learn(field, size, self.averages["stop_fields"])
+                    content += size
+        if stops and text:
+            self._learn("stop_overhead", max(0, len(text) - content) / len(stops))
+
+    def stats(self):
+        """Mean actual/estimate ratio over the recorded samples, and how many there are."""
+        with self._lock:
+            pairs = [(s["estimate"], s["actual"]) for s in self.samples if s["estimate"] and s["actual"]]
+        if not pairs:
+            return {"samples": 0, "actual_vs_estimate": None}
+        return {"samples": len(pairs), "actual_vs_estimate": sum(a / e for e, a in pairs) / len(pairs)}
+
+
+def _content_chars(value):
+    """Characters of actual text in a JSON value, ignoring keys and punctuation."""
+    if isinstance(value, dict):
+        return sum(_content_chars(v) for v in value.values())
+    if isinstance(value, list):
+        return sum(_content_chars(v) for v in value)
+    return len(str(value)) if value is not None else 0
+
+
+def output_limit(model):
+    return MODEL_OUTPUT_LIMITS.get(model, DEFAULT_OUTPUT_LIMIT)
+
+
+_planner = None
+_planner_lock = threading.Lock()
+
+
+def get_token_planner():
+    """Process-wide planner; its state lives next to the LLM cache (TOKEN_PLANNER_PATH overrides)."""
+    global _planner
+    with _planner_lock:
+        if _planner is None:
+            default = os.path.join(os.getenv("LLM_CACHE_DIR", DEFAULT_CACHE_DIR), "planner", "token_stats.json")
+            path = os.getenv("TOKEN_PLANNER_PATH", default)
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            _planner = TokenPlanner(path)
+        return _planner
@@ -1,9 +1,10 @@
 import streamlit as st
 import openai
-import requests
+import copy
 import json
 import os
 import smtplib
+import time
 from email.mime.multipart import MIMEMultipart
 from email.mime.base import MIMEBase
 from email.mime.text import MIMEText
@@ -12,11 +13,23 @@ from reportlab.lib.pagesizes import letter
 from reportlab.lib import colors
 from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 from reportlab.lib.units import inch
-from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer, Image as RLImage, PageBreak
+from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer, PageBreak
 from reportlab.lib.enums import TA_CENTER, TA_LEFT
 from io import BytesIO
-from PIL import Image
+from concurrent.futures import ThreadPoolExecutor, as_completed, TimeoutError as FuturesTimeout
 from dotenv import load_dotenv
+from image_cache import FAILED_DOWNLOAD_TTL_SECONDS, NO_RESULTS_TTL_SECONDS, get_image_cache
+from llm_cache import get_response_cache, make_key
+from llm_fragments import get_fragment_cache
+from token_budget import get_token_planner
+from llm_hedge import get_hedge_policy, hedged_call, hedged_stream
+from model_router import get_model_router
+from llm_json import GenerationTrace, StreamingJSONParser, record_repair, repair_json, repair_stats, valid_stop, validate_itinerary
+from wire_schema import COMPACT_STOP_PATH, TIME_OF_DAY_CODES, expand_day, expand_itinerary, expand_stop, maps_url
+from canonical import canonical_itinerary_request
+from clients import CircuitOpenError, tier_client
+from unsplash import BatchResolver
+from images import DEFAULT_DPI_PROFILE, DPI_PROFILES, IMAGE_PHASE_BUDGET_SECONDS, EmbeddedImage, download_to_cache, image_placeholder, is_unsplash_cdn, prepare_embeddable, render_size, sized_image_url
 
 # Load environment variables
 load_dotenv()
@@ -59,124 +72,539 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
-def fetch_unsplash_image(query, width=800, height=600):
-    """Fetch a specific image from Unsplash based on query"""
-    try:
-        access_key = os.getenv('UNSPLASH_ACCESS_KEY')
-        if not access_key:
-            # Fallback to source URL if no API key
-            return f"https://source.unsplash.com/{width}x{height}/?{query}"
-        
-        url = f"https://api.unsplash.com/search/photos"
-        params = {
-            'query': query,
-            'per_page': 1,
-            'orientation': 'landscape'
-        }
-        headers = {'Authorization': f'Client-ID {access_key}'}
-        
-        response = requests.get(url, params=params, headers=headers, timeout=10)
-        if response.status_code == 200:
-            data = response.json()
-            if data['results']:
-                return data['results'][0]['urls']['regular']
-        
-        # Fallback
-        return f"https://source.unsplash.com/{width}x{height}/?{query}"
-    except Exception as e:
-        st.warning(f"Image fetch warning: {str(e)}")
-        return f"https://source.unsplash.com/{width}x{height}/?{query}"
+# Upper bound on concurrent image lookups/downloads while building a PDF
+IMAGE_PREFETCH_WORKERS = 8
+
+# Size of each stop photo in the PDF
+STOP_IMAGE_WIDTH = 4*inch
+STOP_IMAGE_HEIGHT = 3*inch
+
+def fallback_image_url(query, width=800, height=600):
+    """Keyless source.unsplash.com URL, used when the API has nothing for a stop"""
+    return f"https://source.unsplash.com/{width}x{height}/?{query}"
+
+def resolve_image_url(query, text, resolver, size=(800, 600)):
+    """Resolve one stop's image URL: image cache, then the shared destination pool, then its own search"""
+    if resolver is None:
+        # Fallback to source URL if no API key
+        return fallback_image_url(query, *size)
+    
+    cache = get_image_cache()
+    cached_url = cache.lookup_url(query)
+    if cached_url:
+        return cached_url
+    if cache.is_failed("query", query):
+        # Recently came back empty; don't spend quota on it again
+        return fallback_image_url(query, *size)
+    
+    url = resolver.resolve_one(query, text)
+    if url:
+        cache.store_url(query, url)
+        return url
+    if query in resolver.no_results:
+        cache.mark_failed("query", query, NO_RESULTS_TTL_SECONDS)
+    return fallback_image_url(query, *size)
 
-def download_image(url):
-    """Download image and return as PIL Image"""
+def download_image(url, warn=st.warning):
+    """Download image into the image cache and return its file path"""
+    cache = get_image_cache()
     try:
-        response = requests.get(url, timeout=15)
-        if response.status_code == 200:
-            img = Image.open(BytesIO(response.content))
-            return img
+        if cache.is_failed("url", url):
+            return None
+        path = download_to_cache(url, timeout=15)
+        if path is None:
+            cache.mark_failed("url", url, FAILED_DOWNLOAD_TTL_SECONDS)
+        return path
+    except CircuitOpenError:
+        # Host is known to be down; the stop gets a placeholder without waiting
         return None
     except Exception as e:
-        st.warning(f"Image download error: {str(e)}")
+        cache.mark_failed("url", url, FAILED_DOWNLOAD_TTL_SECONDS)
+        warn(f"Image download error: {str(e)}")
         return None
 
-def generate_itinerary(source, destination, days, budget, travelers, vibe):
-    """Generate structured itinerary using OpenAI"""
+def prepare_image(img_url, profile=DEFAULT_DPI_PROFILE):
+    """Download one render-sized image on a worker thread; returns (PreparedImage, warnings for the caller to show)"""
+    warnings = []
+    size = render_size(STOP_IMAGE_WIDTH, STOP_IMAGE_HEIGHT, profile)
     
-    openai.api_key = os.getenv('OPENAI_API_KEY')
+    if is_unsplash_cdn(img_url):
+        # The CDN crops and encodes to exactly the size we draw
+        img_url = sized_image_url(img_url, STOP_IMAGE_WIDTH, STOP_IMAGE_HEIGHT, profile)
     
-    if not openai.api_key:
-        raise ValueError("OpenAI API key not found. Please set OPENAI_API_KEY in your .env file")
+    path = download_image(img_url, warn=warnings.append)
+    if not path:
+        return None, warnings
+    
+    # CDN images pass straight through; fallback URLs are shrunk with a reduced-scale decode
+    try:
+        return prepare_embeddable(path, size, DPI_PROFILES[profile]['quality']), warnings
+    except Exception as e:
+        warnings.append(f"Image decode error: {str(e)}")
+        return None, warnings
+
+class ImagePrefetcher:
+    """Starts each stop's image lookup and download as soon as add() sees the stop; known images are reused"""
+    
+    def __init__(self, destination, profile=DEFAULT_DPI_PROFILE, max_workers=IMAGE_PREFETCH_WORKERS, known=None,
+                 expected_stops=None):
+        access_key = os.getenv('UNSPLASH_ACCESS_KEY')
+        # Stops whose image failed last time get another attempt, and so do
+        # those whose file has since been evicted from the image cache
+        self.known = {}
+        for query, image in (known or {}).items():
+            if not image:
+                continue
+            try:
+                os.utime(image.path)  # Reuse skips prepare_embeddable, so mark it used here
+            except OSError:
+                continue
+            self.known[query] = image
+        self.profile = profile
+        self.size = render_size(STOP_IMAGE_WIDTH, STOP_IMAGE_HEIGHT, profile)
+        self.resolver = BatchResolver(access_key, destination, expected_stops=expected_stops) if access_key else None
+        self.pool = ThreadPoolExecutor(max_workers=max_workers)
+        self.futures = {}
+    
+    def _fetch(self, query, text):
+        # Runs on a worker thread; warnings are returned, not shown
+        try:
+            url = resolve_image_url(query, text, self.resolver, self.size)
+        except Exception as e:
+            return None, [f"Image fetch warning: {str(e)}"]
+        return prepare_image(url, self.profile)
     
-    prompt = f"""You are a luxury travel agent. Create a detailed {days}-day itinerary for a trip from {source} to {destination}.
+    def add(self, stop):
+        query = stop.get('search_query')
+        if query and query not in self.futures and query not in self.known:
+            self.futures[query] = self.pool.submit(self._fetch, query, f"{stop.get('title', '')} {query}")
+    
+    def reset(self):
+        """Forget every stop added so far; queued fetches are cancelled"""
+        for future in self.futures.values():
+            future.cancel()
+        self.futures = {}
+        if self.resolver:
+            self.resolver.release_claims()
+    
+    def collect(self, budget=IMAGE_PHASE_BUDGET_SECONDS):
+        """Wait up to budget seconds for outstanding images; returns search_query -> PreparedImage, late ones left out"""
+        images = dict(self.known)
+        queries = {future: query for query, future in self.futures.items()}
+        progress = st.progress(0.0, text="📸 Fetching images...")
+        try:
+            for done, future in enumerate(as_completed(queries, timeout=budget), start=1):
+                query = queries[future]
+                try:
+                    images[query], warnings = future.result()
+                except Exception as e:
+                    images[query], warnings = None, [f"Could not add image for {query}: {str(e)}"]
+                for warning in warnings:
+                    st.warning(warning)
+                progress.progress(done / len(queries), text=f"📸 Fetched {done}/{len(queries)} images")
+        except FuturesTimeout:
+            late = sum(query not in images for query in queries.values())
+            st.caption(f"⏱️ {late} image(s) missed the {budget:g}s budget and were replaced with placeholders")
+        finally:
+            # Don't wait on stragglers: queued fetches are dropped, running ones
+            # finish in the background and still warm the image cache
+            for future in queries:
+                future.cancel()
+            self.pool.shutdown(wait=False)
+            progress.empty()
+        if self.resolver:
+            st.caption(f"🔎 Unsplash API calls for this PDF: {self.resolver.api_calls}")
+        if self.known:
+            st.caption(f"♻️ Reused {len(self.known)} image(s) fetched for the previous version of this trip")
+        return images
+
+def prefetch_images(itinerary, destination, profile=DEFAULT_DPI_PROFILE,
+                    max_workers=IMAGE_PREFETCH_WORKERS, budget=IMAGE_PHASE_BUDGET_SECONDS, prefetcher=None, known=None):
+    """Fetch every stop image within a time budget, reusing a prefetcher fed while the itinerary streamed in"""
+    if prefetcher is None:
+        stops = sum(len(day_data['stops']) for day_data in itinerary['detailed_itinerary'])
+        prefetcher = ImagePrefetcher(destination, profile, max_workers, known, expected_stops=stops)
+    for day_data in itinerary['detailed_itinerary']:
+        for stop in day_data['stops']:
+            prefetcher.add(stop)
+    return prefetcher.collect(budget)
+
+ITINERARY_SYSTEM_PROMPT = "You are a luxury travel planning assistant. Always return valid JSON."
+# Compact wire schema (see wire_schema.py): short keys, no derivable content, no indentation
+STOP_SCHEMA_HELP = """Stop keys: w = time of day (M/A/E), p = place or activity name, x = description,
+b = best time, l = logistics (how to get there), v = [vegetarian restaurant, dish],
+nv = [non-vegetarian restaurant, dish], q = specific image search query for the place."""
+
+# The overview only depends on the destination, so it is cached on its own
+# (see llm_fragments.py) and the key is left out of the prompt when cached
+OVERVIEW_PROMPT = '"o":"Brief overview paragraph about {destination} as a destination",'
+
+ITINERARY_PROMPT_TEMPLATE = """You are a luxury travel agent. Create a detailed {days}-day itinerary for a trip from {source} to {destination}.
 
 Budget: ${budget}
 Travelers: {travelers}
 Vibe: {vibe}
 
-STRICT FORMAT - Return ONLY valid JSON with this exact structure:
-
-{{
-  "trip_summary": {{
-    "title": "Trip title",
-    "overview": "Brief overview paragraph"
-  }},
-  "daily_overview": [
-    {{"day": 1, "theme": "Day theme title"}},
-    {{"day": 2, "theme": "Day theme title"}}
-  ],
-  "detailed_itinerary": [
-    {{
-      "day": 1,
-      "stops": [
-        {{
-          "time_of_day": "Morning",
-          "title": "Activity/Place Name",
-          "description": "Detailed description",
-          "best_time": "09:00 AM",
-          "logistics": "Transportation details",
-          "food_options": {{
-            "veg": {{"name": "Restaurant Name", "dish": "Dish name"}},
-            "non_veg": {{"name": "Restaurant Name", "dish": "Dish name"}}
-          }},
-          "search_query": "Specific location name for image search"
-        }}
-      ]
-    }}
-  ]
-}}
+STRICT FORMAT - Return ONLY minified JSON with this exact structure:
+
+{{"t":"Trip title",{overview_key}"d":[{{"n":1,"th":"Day theme title","s":[{{"w":"M","p":"Place","x":"Description","b":"09:00 AM","l":"Transport details","v":["Restaurant","Dish"],"nv":["Restaurant","Dish"],"q":"Eiffel Tower Paris"}}]}}]}}
+
+""" + STOP_SCHEMA_HELP + """
 
 Requirements:
-- Create {days} days with 2-3 stops per day (Morning/Afternoon/Evening)
-- Each stop must have ALL fields filled
-- Food options must be REAL restaurant names in {destination}
-- search_query should be specific (e.g., "Eiffel Tower Paris" not just "Paris")
+- Create {days} days (d) with 2-3 stops (s) per day (Morning/Afternoon/Evening)
+- Each stop must have ALL keys filled
+- Restaurants must be REAL restaurant names in {destination}
+- q should be specific (e.g., "Eiffel Tower Paris" not just "Paris")
 - Logistics should include actual transport options
 - Best times should be realistic
 
 Return ONLY the JSON, no other text."""
 
+# Trips at least this long are planned as a short skeleton call plus one call per day
+SKELETON_MODE_MIN_DAYS = int(os.getenv("SKELETON_MODE_MIN_DAYS", 8))
+DAY_GENERATION_WORKERS = int(os.getenv("DAY_GENERATION_WORKERS", 4))
+MAX_TRIP_DAYS = 30
+# "Compare options" mode: candidates per call, sampled a little hotter so they differ
+MAX_ALTERNATIVES = 3
+ALTERNATIVES_TEMPERATURE = 0.9
+# generate_itinerary's trip parameters, in order
+ITINERARY_REQUEST_FIELDS = ("source", "destination", "days", "budget", "travelers", "vibe")
+
+SKELETON_PROMPT_TEMPLATE = """You are a luxury travel agent. Outline a {days}-day itinerary for a trip from {source} to {destination}.
+
+Budget: ${budget}
+Travelers: {travelers}
+Vibe: {vibe}
+
+STRICT FORMAT - Return ONLY minified JSON with this exact structure:
+
+{{"t":"Trip title",{overview_key}"d":[{{"n":1,"th":"Day theme title"}},{{"n":2,"th":"Day theme title"}}]}}
+
+Requirements:
+- d must have exactly {days} entries, one per day
+- Give every day a distinct theme so no place is visited twice
+
+Return ONLY the JSON, no other text."""
+
+DAY_PROMPT_TEMPLATE = """You are a luxury travel agent planning day {day} of a {days}-day trip from {source} to {destination}.
+
+Budget: ${budget}
+Travelers: {travelers}
+Vibe: {vibe}
+Trip: {title}
+Theme for day {day}: {theme}
+Other days (do not repeat their places): {other_days}
+
+STRICT FORMAT - Return ONLY minified JSON with this exact structure:
+
+{{"n":{day},"s":[{{"w":"M","p":"Place","x":"Description","b":"09:00 AM","l":"Transport details","v":["Restaurant","Dish"],"nv":["Restaurant","Dish"],"q":"Eiffel Tower Paris"}}]}}
+
+""" + STOP_SCHEMA_HELP + """
+
+Requirements:
+- 2-3 stops (Morning/Afternoon/Evening) that fit the day's theme
+- Each stop must have ALL keys filled
+- Restaurants must be REAL restaurant names in {destination}
+- q should be specific (e.g., "Eiffel Tower Paris" not just "Paris")
+- Logistics should include actual transport options
+- Best times should be realistic
+
+Return ONLY the JSON, no other text."""
+
+EXTEND_PROMPT_TEMPLATE = """You are a luxury travel agent extending a trip from {source} to {destination} ("{title}") to {days} days.
+
+Budget: ${budget}
+Travelers: {travelers}
+Vibe: {vibe}
+Days already planned: {existing_days}
+
+STRICT FORMAT - Return ONLY minified JSON with this exact structure:
+
+{{"d":[{{"n":{first_day},"th":"Day theme title"}}]}}
+
+Requirements:
+- d must have one entry for each new day: {new_days}
+- Give every new day a distinct theme that does not repeat the days already planned
+
+Return ONLY the JSON, no other text."""
+
+STOP_PROMPT_TEMPLATE = """You are a luxury travel agent revising day {day} ("{theme}") of a {days}-day trip from {source} to {destination}.
+
+Budget: ${budget}
+Travelers: {travelers}
+Vibe: {vibe}
+Replace this stop with a different place: {replaced}
+Other stops that day (do not repeat them): {other_stops}
+
+STRICT FORMAT - Return ONLY minified JSON with this exact structure:
+
+{{"w":"{time_of_day}","p":"Place","x":"Description","b":"09:00 AM","l":"Transport details","v":["Restaurant","Dish"],"nv":["Restaurant","Dish"],"q":"Eiffel Tower Paris"}}
+
+""" + STOP_SCHEMA_HELP + """
+
+Requirements:
+- Keep the same time of day ({time_of_day})
+- Every key must be filled
+- Restaurants must be REAL restaurant names in {destination}
+- q should be specific (e.g., "Eiffel Tower Paris" not just "Paris")
+
+Return ONLY the JSON, no other text."""
+
+def request_json(prompt, estimate, kind, expand, trace):
+    """One non-streamed completion parsed as JSON and expanded; safe to call from worker threads"""
+    planner = get_token_planner()
+    tier = trace.tier
+    # A slow call is hedged with an identical one (see llm_hedge)
+    response = hedged_call(f"{tier.model}:{kind}", lambda: tier_client().chat.completions.create(
+        model=tier.model,
+        messages=[
+            {"role": "system", "content": ITINERARY_SYSTEM_PROMPT},
+            {"role": "user", "content": prompt}
+        ],
+        temperature=0.7,
+        max_tokens=planner.max_tokens(estimate, tier.model),
+        timeout=tier.timeout
+    ))
+    # None on a refusal or a content-filter stop; repair_json then fails with ValueError like any bad JSON
+    content = response.choices[0].message.content or ""
+    completion_tokens = response.usage.completion_tokens if response.usage else None
+    trace.add_call(completion_tokens)
+    value = None
     try:
-        response = openai.chat.completions.create(
-            model="gpt-4",
-            messages=[
-                {"role": "system", "content": "You are a luxury travel planning assistant. Always return valid JSON."},
-                {"role": "user", "content": prompt}
-            ],
-            temperature=0.7,
-            max_tokens=3000
+        value = expand(repair_json(content, trace.repairs))
+        return value
+    finally:
+        planner.record(kind, estimate, content, completion_tokens, value)
+
+def generate_itinerary_streamed(trip, estimate, trace, on_stop=None):
+    """Single streamed call for the whole itinerary; on_stop fires per completed stop"""
+    planner = get_token_planner()
+    tier = trace.tier
+    # If the first token is slow, an identical stream is opened and the first to produce text wins
+    response = hedged_stream(f"{tier.model}:stream", lambda: tier_client().chat.completions.create(
+        model=tier.model,
+        messages=[
+            {"role": "system", "content": ITINERARY_SYSTEM_PROMPT},
+            {"role": "user", "content": ITINERARY_PROMPT_TEMPLATE.format(**trip)}
+        ],
+        temperature=0.7,
+        max_tokens=planner.max_tokens(estimate, tier.model),
+        timeout=tier.timeout,
+        stream=True,
+        stream_options={"include_usage": True}
+    ), lambda chunk: bool(chunk.choices and chunk.choices[0].delta.content))
+    
+    parser = StreamingJSONParser(COMPACT_STOP_PATH)
+    completion_tokens = None
+    for chunk in response:
+        if chunk.usage:
+            # Sent last, in a chunk with no choices
+            completion_tokens = chunk.usage.completion_tokens
+        if not chunk.choices or not chunk.choices[0].delta.content:
+            continue
+        for path, stop, parents in parser.feed(chunk.choices[0].delta.content):
+            if on_stop:
+                # parents[-1] is the enclosing day object; fall back to its position
+                on_stop(parents[-1].get('n', path[1] + 1), expand_stop(stop))
+    
+    # Tolerates markdown fences, trailing commas and a completion cut off at max_tokens
+    trace.add_call(completion_tokens)
+    itinerary = None
+    try:
+        itinerary = expand_itinerary(repair_json(parser.text, trace.repairs))
+        return itinerary
+    finally:
+        planner.record("full", estimate, parser.text, completion_tokens, itinerary)
+
+def generate_days(trip, day_numbers, title, themes, trace, on_stop=None, max_workers=DAY_GENERATION_WORKERS):
+    """Request the given days concurrently, one call each; returns their day objects"""
+    estimate = get_token_planner().estimate(1, summary=False)
+    detailed = []
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(day_numbers)))) as pool:
+        futures = {}
+        for day in day_numbers:
+            other_days = "; ".join(f"Day {d}: {t}" for d, t in sorted(themes.items()) if d != day)
+            prompt = DAY_PROMPT_TEMPLATE.format(
+                day=day, theme=themes.get(day, "Free exploration"), other_days=other_days or "none",
+                title=title, **trip
+            )
+            futures[pool.submit(request_json, prompt, estimate, "day", expand_day, trace)] = day
+        for future in as_completed(futures):
+            day = futures[future]
+            try:
+                day_data = future.result()
+            except json.JSONDecodeError:
+                continue  # Left missing; complete_missing_days asks for it again
+            if not isinstance(day_data, dict):
+                continue
+            day_data['day'] = day
+            detailed.append(day_data)
+            if on_stop:
+                for stop in day_data.get('stops') or []:
+                    on_stop(day, stop)
+    return detailed
+
+def generate_itinerary_in_parts(trip, trace, on_stop=None, max_workers=DAY_GENERATION_WORKERS):
+    """Skeleton-then-parallel-days generation for long trips"""
+    days = trip['days']
+    estimate = get_token_planner().estimate(days, details=False)
+    skeleton = request_json(SKELETON_PROMPT_TEMPLATE.format(**trip), estimate, "skeleton", expand_itinerary, trace)
+    # The skeleton may itself be a repaired, partial response; validation happens later
+    summary = skeleton.get('trip_summary') or {}
+    themes = {entry['day']: entry['theme'] for entry in skeleton.get('daily_overview') or []
+              if isinstance(entry, dict) and isinstance(entry.get('day'), int) and entry.get('theme')}
+    detailed = generate_days(trip, range(1, days + 1), summary.get('title', ''), themes, trace, on_stop, max_workers)
+    
+    return {
+        "trip_summary": summary,
+        "daily_overview": skeleton.get('daily_overview'),
+        "detailed_itinerary": sorted(detailed, key=lambda day_data: day_data['day']),
+    }
+
+def complete_missing_days(itinerary, trip, trace, on_stop=None):
+    """Re-request only the days that are missing or incomplete; raises ValueError if any still are"""
+    missing = validate_itinerary(itinerary, trip['days'])
+    if missing:
+        st.caption(f"🩹 Re-requesting day(s) {', '.join(map(str, missing))} of an incomplete response")
+        record_repair("days_rerequested", len(missing))
+        trace.repairs.extend(f"day {day}" for day in missing)
+        themes = {entry['day']: entry['theme'] for entry in itinerary['daily_overview']}
+        itinerary['detailed_itinerary'] += generate_days(
+            trip, missing, itinerary['trip_summary']['title'], themes, trace, on_stop
         )
-        
-        content = response.choices[0].message.content.strip()
-        
-        # Clean up potential markdown formatting
-        if content.startswith("```json"):
-            content = content[7:]
-        if content.startswith("```"):
-            content = content[3:]
-        if content.endswith("```"):
-            content = content[:-3]
-        
-        itinerary = json.loads(content.strip())
+        missing = validate_itinerary(itinerary, trip['days'])
+        if missing:
+            raise ValueError(f"Could not generate day(s) {', '.join(map(str, missing))}")
+    return itinerary
+
+def extend_itinerary(previous, trip, trace, on_stop=None):
+    """Resize an itinerary for the same trip to trip['days'], generating only the new days"""
+    days = trip['days']
+    itinerary = copy.deepcopy(previous)
+    itinerary['daily_overview'] = [entry for entry in itinerary['daily_overview'] if entry['day'] <= days]
+    itinerary['detailed_itinerary'] = [day_data for day_data in itinerary['detailed_itinerary'] if day_data['day'] <= days]
+    themes = {entry['day']: entry['theme'] for entry in itinerary['daily_overview']}
+    new_days = [day for day in range(1, days + 1) if day not in themes]
+    if not new_days:
+        return itinerary
+    
+    prompt = EXTEND_PROMPT_TEMPLATE.format(
+        title=itinerary['trip_summary']['title'], first_day=new_days[0],
+        new_days=", ".join(map(str, new_days)),
+        existing_days="; ".join(f"Day {day}: {theme}" for day, theme in sorted(themes.items())) or "none",
+        **trip
+    )
+    estimate = get_token_planner().estimate(len(new_days), details=False)
+    extension = request_json(prompt, estimate, "extend", expand_itinerary, trace)
+    new_themes = {entry['day']: entry['theme'] for entry in extension.get('daily_overview') or []
+                  if isinstance(entry, dict) and entry.get('day') in new_days and entry.get('theme')}
+    for day in new_days:
+        themes[day] = new_themes.get(day, "Free exploration")
+        itinerary['daily_overview'].append({"day": day, "theme": themes[day]})
+    itinerary['detailed_itinerary'] += generate_days(
+        trip, new_days, itinerary['trip_summary']['title'], themes, trace, on_stop
+    )
+    itinerary['detailed_itinerary'].sort(key=lambda day_data: day_data['day'])
+    return itinerary
+
+def itinerary_cache_key(trip, router):
+    return make_key(
+        canonical_itinerary_request(**{field: trip[field] for field in ITINERARY_REQUEST_FIELDS}),
+        # Either generation mode may serve a request as the planner learns, so key on both
+        template=ITINERARY_PROMPT_TEMPLATE + SKELETON_PROMPT_TEMPLATE + DAY_PROMPT_TEMPLATE + OVERVIEW_PROMPT,
+        system=ITINERARY_SYSTEM_PROMPT,
+        # Routing varies with live latency, so key on the tier table rather than the model used
+        models=[tier.model for tier in router.tiers],
+        temperature=0.7,
+    )
+
+def generate_itinerary(source, destination, days, budget, travelers, vibe, fresh=False, on_stop=None, trace=None,
+                       previous=None, on_restart=None):
+    """Generate structured itinerary using OpenAI, resizing previous when only the days changed"""
+    trace = trace or GenerationTrace()
+    router = get_model_router()
+    
+    planner = get_token_planner()
+    estimate = planner.estimate(days)
+    cache = get_response_cache()
+    raw_request = [source, destination, days, budget, travelers, vibe]
+    request = dict(zip(ITINERARY_REQUEST_FIELDS, raw_request))
+    cache_key = itinerary_cache_key(request, router)
+    if not fresh:
+        cached = cache.get(cache_key, raw=raw_request)
+        if cached is not None:
+            st.caption("⚡ Loaded from the itinerary cache")
+            if on_stop:
+                for day_data in cached['detailed_itinerary']:
+                    for stop in day_data['stops']:
+                        on_stop(day_data['day'], stop)
+            return cached
+    
+    if not os.getenv('OPENAI_API_KEY'):
+        raise ValueError("OpenAI API key not found. Please set OPENAI_API_KEY in your .env file")
+    
+    base = None
+    # Trimming a previous itinerary needs no model call, and must not be recorded as a (very fast) tier attempt
+    calls_model = True
+    if previous and not fresh:
+        previous_request, previous_itinerary = previous
+        if canonical_itinerary_request(**dict(previous_request, days=days)) == canonical_itinerary_request(**request):
+            base = previous_itinerary
+            previous_days = len(base['daily_overview'])
+            calls_model = days > previous_days
+            if days != previous_days:
+                st.caption(f"♻️ Only the trip length changed: resizing your {previous_days}-day itinerary "
+                           f"instead of planning it again")
+    
+    # A resized itinerary keeps its overview; otherwise a cached one is left out of the prompt
+    fragments = get_fragment_cache()
+    overview = None if base else fragments.get("destination_overview", OVERVIEW_PROMPT, destination=destination)
+    if overview:
+        trace.tokens_saved += overview[1]
+        estimate = max(0, estimate - overview[1])
+    trip = dict(request, overview_key="" if overview else OVERVIEW_PROMPT.format(destination=destination))
+
+    try:
+        tiers = router.route(days, budget)
+        for attempt, tier in enumerate(tiers):
+            trace.tier = tier
+            trace.repairs = []
+            in_parts = days >= SKELETON_MODE_MIN_DAYS or not planner.fits(estimate, tier.model)
+            started = time.monotonic()
+            try:
+                if base:
+                    itinerary = extend_itinerary(base, trip, trace, on_stop)
+                elif in_parts:
+                    itinerary = generate_itinerary_in_parts(trip, trace, on_stop)
+                else:
+                    itinerary = generate_itinerary_streamed(trip, estimate, trace, on_stop)
+                if overview and isinstance(itinerary, dict) and isinstance(itinerary.get('trip_summary'), dict):
+                    itinerary['trip_summary']['overview'] = overview[0]
+                itinerary = complete_missing_days(itinerary, trip, trace, on_stop)
+            except (openai.APITimeoutError, ValueError) as e:
+                # Timeouts, unsalvageable JSON and failed validation; anything else is not the tier's fault
+                outcome = "timeout" if isinstance(e, openai.APITimeoutError) else "invalid"
+                if calls_model:
+                    router.record(tier, time.monotonic() - started, outcome, raw_request)
+                if attempt == len(tiers) - 1:
+                    raise
+                st.caption(f"↪️ {tier.model} {'timed out' if outcome == 'timeout' else 'returned an invalid itinerary'}; "
+                           f"retrying with {tiers[attempt + 1].model}")
+                if on_restart:
+                    on_restart()
+                continue
+            if calls_model:
+                router.record(tier, time.monotonic() - started, "ok", raw_request)
+            break
+        # Any salvaged response or re-requested day means this request used
+        # to fail outright and need a full regeneration
+        if trace.repairs:
+            record_repair("retries_avoided")
+        if not overview and not base:
+            text = itinerary['trip_summary']['overview']
+            fragments.put("destination_overview", OVERVIEW_PROMPT, text, planner.tokens(text), destination=destination)
+        cache.put(cache_key, itinerary, raw=raw_request)
         return itinerary
     
     except json.JSONDecodeError as e:
@@ -186,9 +614,129 @@ Return ONLY the JSON, no other text."""
         st.error(f"OpenAI API Error: {str(e)}")
         raise
 
-def create_pdf(itinerary, destination, days, budget):
+def generate_alternatives(source, destination, days, budget, travelers, vibe, n, trace=None):
+    """n candidate itineraries from a single completion call; unusable ones are dropped"""
+    trace = trace or GenerationTrace()
+    router = get_model_router()
+    planner = get_token_planner()
+    raw_request = [source, destination, days, budget, travelers, vibe]
+    
+    fragments = get_fragment_cache()
+    overview = fragments.get("destination_overview", OVERVIEW_PROMPT, destination=destination)
+    estimate = planner.estimate(days)
+    if overview:
+        trace.tokens_saved += n * overview[1]
+        estimate = max(0, estimate - overview[1])
+    trip = dict(zip(ITINERARY_REQUEST_FIELDS, raw_request),
+                overview_key="" if overview else OVERVIEW_PROMPT.format(destination=destination))
+    tier = trace.tier = router.route(days, budget)[0]
+    if days >= SKELETON_MODE_MIN_DAYS or not planner.fits(estimate, tier.model):
+        raise ValueError(f"A {days}-day trip is too long to compare options in one call; generate a single itinerary")
+    
+    started = time.monotonic()
+    try:
+        # Not hedged: a duplicate request would cost another n completions
+        response = tier_client().chat.completions.create(
+            model=tier.model,
+            messages=[
+                {"role": "system", "content": ITINERARY_SYSTEM_PROMPT},
+                {"role": "user", "content": ITINERARY_PROMPT_TEMPLATE.format(**trip)}
+            ],
+            temperature=ALTERNATIVES_TEMPERATURE,
+            n=n,
+            max_tokens=planner.max_tokens(estimate, tier.model),
+            timeout=tier.timeout
+        )
+    except openai.APITimeoutError:
+        router.record(tier, time.monotonic() - started, "timeout", raw_request)
+        raise
+    contents = [choice.message.content or "" for choice in response.choices]
+    completion_tokens = response.usage.completion_tokens if response.usage else None
+    trace.add_call(completion_tokens)
+    
+    candidates, dropped = [], []
+    total_chars = sum(map(len, contents)) or 1
+    for content in contents:
+        try:
+            itinerary = expand_itinerary(repair_json(content, trace.repairs))
+        except ValueError:
+            itinerary = None
+            dropped.append("not valid JSON")
+        # Usage covers all n choices; split it by length
+        tokens = round(completion_tokens * len(content) / total_chars) if completion_tokens else None
+        planner.record("alternative", estimate, content, tokens, itinerary)
+        if itinerary is None:
+            continue
+        if overview and isinstance(itinerary, dict) and isinstance(itinerary.get('trip_summary'), dict):
+            itinerary['trip_summary']['overview'] = overview[0]
+        try:
+            candidates.append(complete_missing_days(itinerary, trip, trace))
+        except ValueError as e:
+            dropped.append(str(e))
+    
+    router.record(tier, time.monotonic() - started, "ok" if candidates else "invalid", raw_request)
+    if not candidates:
+        raise ValueError("None of the generated options was a usable itinerary")
+    if len(candidates) < n:
+        st.caption(f"🩹 {n - len(candidates)} of {n} options were unusable and left out ({'; '.join(dropped)})")
+    return candidates
+
+def revise_itinerary(itinerary, request, revise, trace=None):
+    """Apply revise(itinerary, trip, trace) to a copy of an itinerary and cache the validated result"""
+    trace = trace or GenerationTrace()
+    router = get_model_router()
+    raw_request = [request[field] for field in ITINERARY_REQUEST_FIELDS]
+    tier = trace.tier = router.route(request['days'], request['budget'])[0]
+    revised = copy.deepcopy(itinerary)
+    started = time.monotonic()
+    try:
+        revise(revised, dict(request), trace)
+        missing = validate_itinerary(revised, request['days'])
+        if missing:
+            raise ValueError(f"Could not generate day(s) {', '.join(map(str, missing))}")
+    except (openai.APITimeoutError, ValueError) as e:
+        outcome = "timeout" if isinstance(e, openai.APITimeoutError) else "invalid"
+        router.record(tier, time.monotonic() - started, outcome, raw_request)
+        raise
+    router.record(tier, time.monotonic() - started, "ok", raw_request)
+    get_response_cache().put(itinerary_cache_key(request, router), revised, raw=raw_request)
+    return revised
+
+def regenerate_day(itinerary, request, day, trace=None, on_stop=None):
+    """Replace one day's stops with a new set; every other day stays as it was."""
+    def revise(revised, trip, trace):
+        themes = {entry['day']: entry['theme'] for entry in revised['daily_overview']}
+        kept = [day_data for day_data in revised['detailed_itinerary'] if day_data['day'] != day]
+        replaced = generate_days(trip, [day], revised['trip_summary']['title'], themes, trace, on_stop)
+        revised['detailed_itinerary'] = sorted(kept + replaced, key=lambda day_data: day_data['day'])
+    return revise_itinerary(itinerary, request, revise, trace)
+
+def regenerate_stop(itinerary, request, day, index, trace=None):
+    """Replace the index-th stop of a day with a different place at the same time of day."""
+    def revise(revised, trip, trace):
+        day_data = next(day_data for day_data in revised['detailed_itinerary'] if day_data['day'] == day)
+        stop = day_data['stops'][index]
+        theme = next((entry['theme'] for entry in revised['daily_overview'] if entry['day'] == day), "")
+        time_code = next((code for code, name in TIME_OF_DAY_CODES.items() if name == stop['time_of_day']),
+                         stop['time_of_day'])
+        prompt = STOP_PROMPT_TEMPLATE.format(
+            day=day, theme=theme, replaced=stop['title'], time_of_day=time_code,
+            other_stops="; ".join(other['title'] for i, other in enumerate(day_data['stops']) if i != index) or "none",
+            **trip
+        )
+        estimate = get_token_planner().estimate(1, stops_per_day=1, summary=False)
+        replacement = request_json(prompt, estimate, "stop", expand_stop, trace)
+        if not valid_stop(replacement):
+            raise ValueError(f"The replacement for {stop['title']} is incomplete")
+        day_data['stops'][index] = replacement
+    return revise_itinerary(itinerary, request, revise, trace)
+
+def create_pdf(itinerary, destination, days, budget, images=None, profile=DEFAULT_DPI_PROFILE):
     """Generate professional PDF with images"""
     
+    if images is None:
+        images = prefetch_images(itinerary, destination, profile)
+    
     buffer = BytesIO()
     doc = SimpleDocTemplate(buffer, pagesize=letter, topMargin=0.5*inch, bottomMargin=0.5*inch)
     story = []
@@ -281,24 +829,14 @@ def create_pdf(itinerary, destination, days, budget):
             story.append(Spacer(1, 0.2*inch))
             story.append(Paragraph(f"⏰ {stop['time_of_day']}: {stop['title']}", heading_style))
             
-            # Try to fetch and add image
-            try:
-                img_url = fetch_unsplash_image(stop['search_query'])
-                img = download_image(img_url)
-                
-                if img:
-                    # Save to temp buffer
-                    img_buffer = BytesIO()
-                    img = img.convert('RGB')
-                    img.thumbnail((400, 300))
-                    img.save(img_buffer, format='JPEG')
-                    img_buffer.seek(0)
-                    
-                    rl_img = RLImage(img_buffer, width=4*inch, height=3*inch)
-                    story.append(rl_img)
-                    story.append(Spacer(1, 0.1*inch))
-            except Exception as e:
-                st.warning(f"Could not add image for {stop['title']}: {str(e)}")
+            # Add the prefetched image, or a placeholder if it didn't arrive.
+            # Paths are content-addressed, so repeated photos share one embedded copy
+            prepared = images.get(stop['search_query'])
+            if prepared:
+                story.append(EmbeddedImage(prepared, STOP_IMAGE_WIDTH, STOP_IMAGE_HEIGHT))
+            else:
+                story.append(image_placeholder(STOP_IMAGE_WIDTH, STOP_IMAGE_HEIGHT))
+            story.append(Spacer(1, 0.1*inch))
             
             # Details
             story.append(Paragraph(f"<b>Description:</b> {stop['description']}", body_style))
@@ -311,12 +849,16 @@ def create_pdf(itinerary, destination, days, budget):
             story.append(Paragraph(f"<b>🥗 Veg Option:</b> {veg['dish']} at {veg['name']}", body_style))
             story.append(Paragraph(f"<b>🍗 Non-Veg Option:</b> {non_veg['dish']} at {non_veg['name']}", body_style))
             
-            story.append(Paragraph(f"<b>📍 Google Maps:</b> <link href='[https://www.google.com/maps/search/?api=1&query=](https://www.google.com/maps/search/?api=1&query=){stop['search_query'].replace(' ', '+')}'>Search Location</link>", body_style))
+            story.append(Paragraph(f"<b>📍 Google Maps:</b> <link href='{maps_url(stop['search_query'])}'>Search Location</link>", body_style))
             
             story.append(Spacer(1, 0.2*inch))
         
         story.append(PageBreak())
     
+    embedded = [prepared.path for prepared in images.values() if prepared]
+    if embedded:
+        st.caption(f"🖼️ {len(embedded)} photos embedded as {len(set(embedded))} unique images")
+    
     # Build PDF
     doc.build(story)
     buffer.seek(0)
@@ -370,6 +912,129 @@ def send_email(recipient_email, pdf_buffer, destination):
         return False
 
 # Main App
+def deliver_itinerary(itinerary, request, email, profile, prefetcher=None, known=None):
+    """Build the PDF, save it, email it and offer it for download"""
+    destination, days, budget = request['destination'], request['days'], request['budget']
+    with st.spinner("📸 Fetching stunning visuals..."):
+        # Create PDF
+        images = prefetch_images(itinerary, destination, profile, prefetcher=prefetcher, known=known)
+        pdf_buffer = create_pdf(itinerary, destination, days, budget, images=images, profile=profile)
+        st.success("✅ PDF created!")
+        cache_stats = get_image_cache().stats()
+        st.caption(f"🗂️ Image cache: {cache_stats['url_hits']} lookup hits "
+                   f"({cache_stats['url_hits_canonical_only']} via canonical keys) / {cache_stats['url_misses']} misses, "
+                   f"{cache_stats['image_hits']} download hits / {cache_stats['image_misses']} misses")
+
+        # --- NEW CODE START: Save PDF locally ---
+        local_filename = f"{destination}_Luxury_Itinerary.pdf"
+        with open(local_filename, "wb") as f:
+            f.write(pdf_buffer.getvalue())
+        st.info(f"💾 PDF saved locally as: {local_filename}")
+        # --- NEW CODE END ---
+    
+    queries = {stop['search_query'] for day_data in itinerary['detailed_itinerary'] for stop in day_data['stops']}
+    st.session_state['trip_plan'] = {
+        "request": request,
+        "itinerary": itinerary,
+        "profile": profile,
+        "images": {query: image for query, image in images.items() if query in queries},
+    }
+    
+    with st.spinner("📧 Sending to your inbox..."):
+        # Send email
+        if send_email(email, pdf_buffer, destination):
+            st.markdown(f"""
+            <div class="success-box">
+                <h3>🎉 Success!</h3>
+                <p>Your luxury itinerary has been sent to <b>{email}</b></p>
+                <p>Check your inbox for your personalized travel guide!</p>
+            </div>
+            """, unsafe_allow_html=True)
+            
+            # Offer download
+            pdf_buffer.seek(0)
+            st.download_button(
+                label="📥 Download PDF Now",
+                data=pdf_buffer,
+                file_name=f"{destination}_Luxury_Itinerary.pdf",
+                mime="application/pdf"
+            )
+
+def offer_alternatives(request, n):
+    """Generate n candidate itineraries in one call and keep them for choose_alternative."""
+    try:
+        with st.spinner(f"✨ AI is crafting {n} options for your journey..."):
+            started = time.monotonic()
+            trace = GenerationTrace()
+            candidates = generate_alternatives(*(request[field] for field in ITINERARY_REQUEST_FIELDS), n, trace)
+            st.success(f"✅ {len(candidates)} itineraries generated in {time.monotonic() - started:.2f}s!")
+            st.caption(f"🧾 {trace.completion_tokens} completion tokens over {trace.calls} call(s) "
+                       f"on the {trace.tier.name} tier ({trace.tier.model})")
+        st.session_state['candidates'] = {"request": request, "itineraries": candidates}
+    except Exception as e:
+        st.error(f"❌ Error: {str(e)}")
+
+def choose_alternative(candidates, email, profile):
+    """Show the candidate itineraries side by side; only the one picked gets images and a PDF."""
+    itineraries = candidates['itineraries']
+    st.markdown("---")
+    st.markdown("### 🎲 Pick Your Itinerary")
+    for number, (column, itinerary) in enumerate(zip(st.columns(len(itineraries)), itineraries), start=1):
+        with column:
+            st.markdown(f"**Option {number}: {itinerary['trip_summary']['title']}**")
+            for entry in itinerary['daily_overview']:
+                st.caption(f"Day {entry['day']}: {entry['theme']}")
+    choice = st.radio("Option", range(len(itineraries)), format_func=lambda i: f"Option {i + 1}", horizontal=True)
+    if not st.button("📄 Create PDF for This Option"):
+        return
+    if not email:
+        st.error("Please fill in your email address!")
+        return
+    try:
+        deliver_itinerary(itineraries[choice], candidates['request'], email, profile)
+    except Exception as e:
+        st.error(f"❌ Error: {str(e)}")
+
+def adjust_itinerary(plan, email):
+    """Controls to regenerate one day or one stop of the last itinerary, then rebuild its PDF."""
+    itinerary = plan['itinerary']
+    st.markdown("---")
+    st.markdown("### ✏️ Fine-tune Your Itinerary")
+    col1, col2 = st.columns(2)
+    with col1:
+        day = st.selectbox("Day", [day_data['day'] for day_data in itinerary['detailed_itinerary']],
+                           format_func=lambda day: f"Day {day}")
+    stops = next(day_data['stops'] for day_data in itinerary['detailed_itinerary'] if day_data['day'] == day)
+    with col2:
+        index = st.selectbox("Stop", range(len(stops)),
+                             format_func=lambda i: f"{stops[i]['time_of_day']}: {stops[i]['title']}")
+    
+    col3, col4 = st.columns(2)
+    with col3:
+        new_day = st.button(f"🔁 Regenerate Day {day}")
+    with col4:
+        new_stop = st.button("🔁 Replace This Stop")
+    if not (new_day or new_stop):
+        return
+    if not email:
+        st.error("Please fill in your email address!")
+        return
+    
+    try:
+        with st.spinner("✨ Reworking your itinerary..."):
+            started = time.monotonic()
+            trace = GenerationTrace()
+            if new_day:
+                itinerary = regenerate_day(itinerary, plan['request'], day, trace)
+            else:
+                itinerary = regenerate_stop(itinerary, plan['request'], day, index, trace)
+            st.success(f"✅ Itinerary updated in {time.monotonic() - started:.2f}s!")
+            st.caption(f"🧾 {trace.completion_tokens} completion tokens over {trace.calls} call(s) "
+                       f"on the {trace.tier.name} tier ({trace.tier.model})")
+        deliver_itinerary(itinerary, plan['request'], email, plan['profile'], known=plan['images'])
+    except Exception as e:
+        st.error(f"❌ Error: {str(e)}")
+
 def main():
     st.markdown('<h1 class="main-header">✈️ Luxe AI Travel Agent</h1>', unsafe_allow_html=True)
     st.markdown("### Curated Luxury Experiences, Powered by AI")
@@ -385,7 +1050,7 @@ def main():
     with col1:
         source = st.text_input("🏠 From City", placeholder="New York")
         destination = st.text_input("🌍 Destination", placeholder="Paris")
-        days = st.slider("📅 Duration (Days)", 1, 14, 5)
+        days = st.slider("📅 Duration (Days)", 1, MAX_TRIP_DAYS, 5)
         budget = st.number_input("💰 Budget (USD)", min_value=500, max_value=100000, value=5000, step=500)
     
     with col2:
@@ -399,6 +1064,15 @@ def main():
             "Foodie Paradise"
         ])
         email = st.text_input("📧 Email Address", placeholder="your@email.com")
+        image_profile = st.selectbox(
+            "🖼️ Image Quality",
+            list(DPI_PROFILES),
+            index=list(DPI_PROFILES).index(DEFAULT_DPI_PROFILE),
+            format_func=lambda p: f"{p.title()} ({DPI_PROFILES[p]['dpi']} DPI)"
+        )
+        alternatives = st.number_input("🎲 Options to Compare", min_value=1, max_value=MAX_ALTERNATIVES, value=1,
+                                       help="Several candidate itineraries from one request; only the one you pick gets a PDF")
+        fresh = st.checkbox("🔄 Fresh itinerary (skip cache)", value=False)
     
     st.markdown("---")
     
@@ -407,47 +1081,84 @@ def main():
             st.error("Please fill in all required fields!")
             return
         
-        try:
-            with st.spinner("✨ AI is crafting your perfect journey..."):
-                # Generate itinerary
-                itinerary = generate_itinerary(source, destination, days, budget, travelers, vibe)
-                st.success("✅ Itinerary generated!")
+        # The last itinerary of this session; changing only the number of days
+        # extends or trims it, and its stops' images are reused either way
+        plan = st.session_state.get('trip_plan')
+        request = dict(source=source, destination=destination, days=days, budget=budget, travelers=travelers, vibe=vibe)
+        
+        st.session_state.pop('candidates', None)
+        if alternatives > 1:
+            offer_alternatives(request, alternatives)
+        else:
+            try:
+                # Stop photos start downloading while the rest of the itinerary streams in
+                known = plan['images'] if plan and plan['profile'] == image_profile else None
+                prefetcher = ImagePrefetcher(destination, image_profile, known=known)
+                live_slot = st.empty()
+                live = [live_slot.container()]
+                shown_days = set()
+                first_stop = []
             
-            with st.spinner("📸 Fetching stunning visuals..."):
-                # Create PDF
-                pdf_buffer = create_pdf(itinerary, destination, days, budget)
-                st.success("✅ PDF created!")
-
-                # --- NEW CODE START: Save PDF locally ---
-                local_filename = f"{destination}_Luxury_Itinerary.pdf"
-                with open(local_filename, "wb") as f:
-                    f.write(pdf_buffer.getvalue())
-                st.info(f"💾 PDF saved locally as: {local_filename}")
-                # --- NEW CODE END ---
+                def show_stop(day, stop):
+                    if not first_stop:
+                        first_stop.append(time.monotonic() - started)
+                    if day not in shown_days:
+                        shown_days.add(day)
+                        live[0].markdown(f"#### Day {day}")
+                    live[0].markdown(f"- ⏰ **{stop.get('time_of_day', '')}**: {stop.get('title', '')}")
+                    prefetcher.add(stop)
+                
+                def restart():
+                    # A model tier failed and the next one starts over: drop its stops from the page and the image queue
+                    shown_days.clear()
+                    live[0] = live_slot.container()
+                    prefetcher.reset()
+            
+                with st.spinner("✨ AI is crafting your perfect journey..."):
+                    # Generate itinerary
+                    started = time.monotonic()
+                    trace = GenerationTrace()
+                    itinerary = generate_itinerary(source, destination, days, budget, travelers, vibe,
+                                                   fresh=fresh, on_stop=show_stop, trace=trace,
+                                                   previous=(plan['request'], plan['itinerary']) if plan else None,
+                                                   on_restart=restart)
+                    st.success(f"✅ Itinerary generated in {time.monotonic() - started:.2f}s!")
+                    if trace.calls:
+                        st.caption(f"🧾 {trace.completion_tokens} completion tokens over {trace.calls} call(s) "
+                                   f"on the {trace.tier.name} tier ({trace.tier.model})")
+                    if trace.tokens_saved:
+                        st.caption(f"🧩 Reused the cached overview of {destination}, "
+                                   f"saving ~{trace.tokens_saved} completion tokens")
+                    if first_stop:
+                        st.caption(f"⏱️ First stop shown after {first_stop[0]:.2f}s")
+                    llm_stats = get_response_cache().stats()
+                    st.caption(f"🗂️ Itinerary cache: {llm_stats['hits']} hits / {llm_stats['misses']} misses "
+                               f"({llm_stats['canonical_only_hits']} hits only thanks to canonical keys)")
+                    planned = get_token_planner().stats()
+                    if planned['samples']:
+                        st.caption(f"🧮 Token planner: actual usage averages {planned['actual_vs_estimate']:.0%} "
+                                   f"of estimate over {planned['samples']} completions")
+                    hedges = get_hedge_policy().stats()
+                    if hedges['hedged']:
+                        st.caption(f"🏁 Hedged {hedges['hedged']}/{hedges['requests']} LLM requests, "
+                                   f"hedge won {hedges['hedge_wins']}, {hedges['capped']} held back by the rate cap")
+                    repairs = repair_stats()
+                    if repairs['responses']:
+                        st.caption(f"🩹 JSON repairs: {repairs['repaired']}/{repairs['responses']} responses "
+                                   f"({repairs['repaired'] / repairs['responses']:.0%}), "
+                                   f"{repairs['days_rerequested']} day(s) re-requested, "
+                                   f"{repairs['retries_avoided']} full retries avoided")
             
-            with st.spinner("📧 Sending to your inbox..."):
-                # Send email
-                if send_email(email, pdf_buffer, destination):
-                    st.markdown(f"""
-                    <div class="success-box">
-                        <h3>🎉 Success!</h3>
-                        <p>Your luxury itinerary has been sent to <b>{email}</b></p>
-                        <p>Check your inbox for your personalized travel guide!</p>
-                    </div>
-                    """, unsafe_allow_html=True)
-                    
-                    # Offer download
-                    pdf_buffer.seek(0)
-                    st.download_button(
-                        label="📥 Download PDF Now",
-                        data=pdf_buffer,
-                        file_name=f"{destination}_Luxury_Itinerary.pdf",
-                        mime="application/pdf"
-                    )
+                deliver_itinerary(itinerary, request, email, image_profile, prefetcher=prefetcher)
         
-        except Exception as e:
-            st.error(f"❌ Error: {str(e)}")
-            st.info("💡 Tip: Make sure your .env file contains valid API keys")
+            except Exception as e:
+                st.error(f"❌ Error: {str(e)}")
+                st.info("💡 Tip: Make sure your .env file contains valid API keys")
+    
+    if st.session_state.get('candidates'):
+        choose_alternative(st.session_state['candidates'], email, image_profile)
+    if st.session_state.get('trip_plan'):
+        adjust_itinerary(st.session_state['trip_plan'], email)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,208 @@
+"""
+Unsplash search, batched per destination.
+
+The demo tier allows 50 API requests per hour, so searching once per stop
+burns through it after a single long itinerary. BatchResolver instead pulls a
+large candidate pool with a few destination-level searches, matches stops to
+photos by their description/tags, and only searches per stop for leftovers.
+"""
+
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from clients import guarded_get
+
+UNSPLASH_SEARCH_URL = "https://api.unsplash.com/search/photos"
+
+# Unsplash caps per_page at 30
+BATCH_PER_PAGE = 30
+BATCH_QUERIES = ("{destination}", "{destination} landmarks")
+MIN_MATCH_SCORE = 0.5
+FALLBACK_WORKERS = 4
+
+_STOPWORDS = {
+    "the", "and", "for", "with", "from", "into", "near", "tour", "visit", "trip",
+    "morning", "afternoon", "evening", "night", "lunch", "dinner", "breakfast",
+}
+_WORD_RE = re.compile(r"[^\W_]+", re.UNICODE)
+
+
+def _tokens(text):
+    return {w for w in _WORD_RE.findall((text or "").casefold()) if len(w) > 2 and w not in _STOPWORDS}
+
+
+def search_photos(access_key, query, per_page=1, page=1, timeout=10):
+    """One /search/photos call; returns the list of result dicts."""
+    response = guarded_get(
+        UNSPLASH_SEARCH_URL,
+        params={"query": query, "per_page": per_page, "page": page, "orientation": "landscape"},
+        headers={"Authorization": f"Client-ID {access_key}"},
+        timeout=timeout,
+    )
+    response.raise_for_status()
+    return response.json().get("results", [])
+
+
+class BatchResolver:
+    """Resolves image URLs for every stop of one trip.
+
+    api_calls counts the /search/photos requests actually made, so callers
+    can report calls per PDF. no_results collects queries whose own search
+    came back empty, as opposed to ones that errored. Pass expected_stops
+    when the number of stops is known up front, so resolve_one can skip
+    the pool for a trip too small to be worth batching, as resolve() does.
+    """
+
+    def __init__(self, access_key, destination, timeout=10, url_size="raw", expected_stops=None):
+        self.access_key = access_key
+        self.destination = destination
+        self.timeout = timeout
+        self.url_size = url_size
+        self.api_calls = 0
+        self.no_results = set()
+        self._lock = threading.Lock()
+        self.expected_stops = expected_stops
+        self._pool = None
+        self._pool_loading = False
+        self._pool_ready = threading.Event()
+        self._claimed = set()
+        self._waiting = {}  # Query -> tokens of stops matching against the pool right now
+
+    def _search(self, query, per_page):
+        with self._lock:
+            self.api_calls += 1
+        return search_photos(self.access_key, query, per_page=per_page, timeout=self.timeout)
+
+    def _candidate_pool(self):
+        pool = {}
+        for template in BATCH_QUERIES:
+            try:
+                results = self._search(template.format(destination=self.destination), BATCH_PER_PAGE)
+            except Exception as e:
+                print(f"Unsplash batch search failed for {self.destination}: {e}")
+                continue
+            for photo in results:
+                pool.setdefault(photo["id"], photo)
+        return list(pool.values())
+
+    @staticmethod
+    def _photo_tokens(photo):
+        text = [photo.get("description"), photo.get("alt_description")]
+        text += [tag.get("title") for tag in photo.get("tags") or []]
+        return _tokens(" ".join(t for t in text if t))
+
+    def _fallback(self, query):
+        try:
+            results = self._search(query, 1)
+        except Exception as e:
+            print(f"Unsplash search failed for {query}: {e}")
+            return None
+        if not results:
+            with self._lock:
+                self.no_results.add(query)
+            return None
+        return results[0]["urls"][self.url_size]
+
+    def resolve_one(self, query, text):
+        """Resolve a single stop as soon as it is known, e.g. while the itinerary streams in.
+
+        The destination pool is fetched once, by the first caller, and shared
+        by every later stop; no lock is held during the fetch, and stops that
+        need no pool (see expected_stops) search on their own meanwhile.
+        Stops matching at the same time are matched best-first, as in
+        resolve(); a stop that arrives later only gets what is left.
+        """
+        # A couple of stops are cheaper to search directly than to batch
+        if self.expected_stops is not None and self.expected_stops <= len(BATCH_QUERIES):
+            return self._fallback(query)
+
+        tokens = _tokens(text) - _tokens(self.destination)
+        with self._lock:
+            self._waiting[query] = tokens
+            load = not self._pool_loading
+            self._pool_loading = True
+        try:
+            if load:
+                pool = []
+                try:
+                    pool = [(photo, self._photo_tokens(photo)) for photo in self._candidate_pool()]
+                finally:
+                    with self._lock:
+                        self._pool = pool
+                    self._pool_ready.set()
+            else:
+                self._pool_ready.wait()
+            url = self._claim(query, tokens)
+        finally:
+            with self._lock:
+                self._waiting.pop(query, None)
+        return url or self._fallback(query)
+
+    def release_claims(self):
+        """Return every pool photo handed out by resolve_one, e.g. when those stops were discarded."""
+        with self._lock:
+            self._claimed.clear()
+
+    def _claim(self, query, tokens):
+        """Take the best unclaimed pool photo for tokens, leaving photos a waiting stop matches better."""
+        if not tokens:
+            return None
+        with self._lock:
+            rivals = [other for key, other in self._waiting.items() if key != query and other]
+            ranked = sorted(((-len(tokens & photo_tokens) / len(tokens), index)
+                             for index, (_, photo_tokens) in enumerate(self._pool) if index not in self._claimed))
+            for negative_score, index in ranked:
+                score = -negative_score
+                if score < MIN_MATCH_SCORE:
+                    break
+                photo_tokens = self._pool[index][1]
+                if any(len(other & photo_tokens) / len(other) > score for other in rivals):
+                    continue
+                self._claimed.add(index)
+                return self._pool[index][0]["urls"][self.url_size]
+        return None
+
+    def resolve(self, stops):
+        """Map each stop's search query to an image URL (or None).
+
+        stops is a dict of search query -> text to match against photo
+        descriptions (e.g. the stop title). Each pool photo is given to at
+        most one stop, best matches first; unmatched stops are searched by
+        their own query.
+        """
+        if not stops:
+            return {}
+
+        # A couple of stops are cheaper to search directly than to batch
+        if len(stops) <= len(BATCH_QUERIES):
+            return {key: self._fallback(key) for key in stops}
+
+        destination_tokens = _tokens(self.destination)
+        stop_tokens = {key: _tokens(text) - destination_tokens for key, text in stops.items()}
+
+        pool = self._candidate_pool()
+        pairs = []
+        for index, photo in enumerate(pool):
+            photo_tokens = self._photo_tokens(photo)
+            for key, tokens in stop_tokens.items():
+                if not tokens:
+                    continue
+                score = len(tokens & photo_tokens) / len(tokens)
+                if score >= MIN_MATCH_SCORE:
+                    pairs.append((score, index, key))
+
+        resolved = {}
+        used = set()
+        for score, index, key in sorted(pairs, key=lambda p: -p[0]):
+            if key in resolved or index in used:
+                continue
+            resolved[key] = pool[index]["urls"][self.url_size]
+            used.add(index)
+
+        unmatched = [key for key in stops if key not in resolved]
+        if unmatched:
+            with ThreadPoolExecutor(max_workers=min(FALLBACK_WORKERS, len(unmatched))) as executor:
+                for key, url in zip(unmatched, executor.map(self._fallback, unmatched)):
+                    resolved[key] = url
+        return resolved
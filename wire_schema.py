@@ -0,0 +1,174 @@
+"""
+Compact output formats for the itinerary prompts, and their expanders.
+
+Every output token is one we wait for, and the verbose formats spent a lot
+of them on long key names, repeated section labels and Google Maps
+markup we can build ourselves. The prompts now ask for short keys and only
+the content the model has to invent; the functions here expand that back
+into exactly the structures create_pdf / generate_pdf already consume.
+"""
+
+from urllib.parse import quote_plus
+
+# ---------------- JSON (travel_agent_py.py) ---------------- #
+
+# Streamed stop objects live here in the compact document
+COMPACT_STOP_PATH = ("d", "*", "s", "*")
+
+TIME_OF_DAY_CODES = {"M": "Morning", "A": "Afternoon", "E": "Evening", "N": "Night"}
+
+# Compact stop key -> itinerary stop field
+STOP_KEYS = {"w": "time_of_day", "p": "title", "x": "description", "b": "best_time", "l": "logistics", "q": "search_query"}
+FOOD_KEYS = {"v": "veg", "nv": "non_veg"}
+
+
+def maps_url(query):
+    return f"https://maps.google.com/?q={quote_plus(query)}"
+
+
+def _food(value):
+    # ["Restaurant", "Dish"]; anything else is left for validation to reject
+    if isinstance(value, list) and len(value) == 2:
+        return {"name": value[0], "dish": value[1]}
+    return None
+
+
+def expand_stop(compact):
+    """Compact stop -> itinerary stop; keys the model left out stay missing."""
+    if not isinstance(compact, dict):
+        return compact
+    stop = {field: compact[key] for key, field in STOP_KEYS.items() if key in compact}
+    if "time_of_day" in stop:
+        stop["time_of_day"] = TIME_OF_DAY_CODES.get(stop["time_of_day"], stop["time_of_day"])
+    food = {kind: _food(compact.get(key)) for key, kind in FOOD_KEYS.items()}
+    if any(food.values()):
+        stop["food_options"] = food
+    return stop
+
+
+def expand_day(compact):
+    """{"n": 2, "s": [...]} -> {"day": 2, "stops": [...]}"""
+    if not isinstance(compact, dict):
+        return compact
+    day = {"stops": [expand_stop(stop) for stop in compact.get("s") or []]}
+    if "n" in compact:
+        day["day"] = compact["n"]
+    return day
+
+
+def expand_itinerary(compact):
+    """Compact itinerary (or skeleton) -> trip_summary / daily_overview / detailed_itinerary."""
+    if not isinstance(compact, dict):
+        return compact
+    days = [day for day in compact.get("d") or [] if isinstance(day, dict)]
+    itinerary = {
+        "trip_summary": {key: compact[short] for short, key in (("t", "title"), ("o", "overview")) if short in compact},
+        "daily_overview": [{"day": day.get("n"), "theme": day.get("th")} for day in days],
+    }
+    if any("s" in day for day in days):
+        itinerary["detailed_itinerary"] = [expand_day(day) for day in days if "s" in day]
+    return itinerary
+
+
+# ---------------- TEXT (app.py) ---------------- #
+
+# One-letter stop line tags
+TEXT_STOP_TAGS = {"B": "best_time", "L": "logistics", "X": "details", "V": "veg", "N": "non_veg"}
+
+
+def parse_compact_text(compact):
+    """Split the compact line format into its sections; stops become dicts.
+
+    A line without a known tag continues whatever came before it: the
+    overview / getting-there paragraph, or the last tagged field when the
+    model wrapped a long value onto another line.
+    """
+    parsed = {"overview": [], "getting_there": [], "timeline": [], "days": [], "tips": []}
+    section = None
+    last = None  # (container, key) of the last single-line field
+    for raw in compact.splitlines():
+        line = raw.strip()
+        if not line:
+            continue
+        tag, _, value = line.partition(":")
+        tag, value = tag.strip().upper(), value.strip()
+        if section == "tips":
+            parsed["tips"].append(line)
+            continue
+        if tag in ("O", "G", "TIPS"):
+            section = {"O": "overview", "G": "getting_there", "TIPS": "tips"}[tag]
+            last = None
+            if value:
+                parsed[section].append(value)
+            continue
+        if tag == "T":
+            parsed["timeline"].append(value)
+            section, last = None, (parsed["timeline"], len(parsed["timeline"]) - 1)
+        elif tag == "D":
+            parsed["days"].append({"title": value, "stops": []})
+            section, last = None, (parsed["days"][-1], "title")
+        elif tag == "S" and parsed["days"]:
+            place, _, when = value.partition("|")
+            parsed["days"][-1]["stops"].append({"place": place.strip(), "when": when.strip()})
+            section, last = None, None
+        elif tag in TEXT_STOP_TAGS and parsed["days"] and parsed["days"][-1]["stops"]:
+            stop = parsed["days"][-1]["stops"][-1]
+            stop[TEXT_STOP_TAGS[tag]] = value
+            section, last = None, (stop, TEXT_STOP_TAGS[tag])
+        elif section:
+            # Continuation of a multi-line overview / getting-there paragraph
+            parsed[section].append(line)
+        elif last:
+            container, key = last
+            container[key] = f"{container[key]} {line}".strip()
+    return parsed
+
+
+def missing_text_days(compact, days):
+    """Day numbers (1..days) that the compact text has no stops for."""
+    parsed = parse_compact_text(compact)
+    present = {n for n, day in enumerate(parsed["days"], start=1) if day["stops"]}
+    return [n for n in range(1, days + 1) if n not in present]
+
+
+def _render_stop(stop, destination):
+    when = TIME_OF_DAY_CODES.get(stop["when"].upper(), stop["when"])
+    lines = [f"STOP: {stop['place']} - {when}" if when else f"STOP: {stop['place']}"]
+    if "best_time" in stop:
+        lines.append(f"BEST TIME: {stop['best_time']}")
+    if "logistics" in stop:
+        lines.append(f"LOGISTICS: {stop['logistics']}")
+    url = maps_url(f"{destination} {stop['place']}")
+    details = stop.get("details", "")
+    lines.append(f'DETAILS: {details} <link href="{url}" color="blue">Open Map</link>'.replace(":  <", ": <"))
+    if "veg" in stop or "non_veg" in stop:
+        lines.append("FOOD:")
+        if "veg" in stop:
+            lines.append(f"- 🥗 Veg: {stop['veg']}")
+        if "non_veg" in stop:
+            lines.append(f"- 🍗 Non-Veg: {stop['non_veg']}")
+    return lines
+
+
+def expand_itinerary_text(compact, destination, sections=None):
+    """Expand the compact line format into the tagged text generate_pdf parses.
+
+    The title, section markers, day numbers, field labels, food emoji and
+    map links are all produced here instead of being written by the model.
+    sections maps parse_compact_text section names to cached lines for the
+    sections the prompt left out (see llm_fragments).
+    """
+    parsed = parse_compact_text(compact)
+    for section, lines in (sections or {}).items():
+        if not parsed[section]:
+            parsed[section] = list(lines)
+    out = [f"TITLE: Journey to {destination}", "OVERVIEW:", *parsed["overview"]]
+    out += ["GETTING_THERE:", *parsed["getting_there"]]
+    out += ["TIMELINE_START", *(f"Day {n}: {summary}" for n, summary in enumerate(parsed["timeline"], start=1))]
+    out += ["TIMELINE_END", "ITINERARY_START"]
+    for n, day in enumerate(parsed["days"], start=1):
+        out.append(f"Day {n}: {day['title']}")
+        for stop in day["stops"]:
+            out += _render_stop(stop, destination)
+    out += ["ITINERARY_END", "TRAVEL_TIPS:", *parsed["tips"]]
+    return "\n".join(out)